@@ -0,0 +1,203 @@
+"""
+Statystyki zajetosci szafek liczone przyrostowo, w miare zdarzen.
+
+Serwer wola deposit/release/lock/unlock/sensor przy kazdej zmianie,
+a report() i locker_report() tylko skladaja gotowe liczniki - bez
+zapytan do bazy i bez przechodzenia po wszystkich szafkach.
+
+Czas trwajacych zajec (i otwartych drzwi) liczymy bez petli dzieki sumie
+znacznikow czasu: sum(now - since) = n * now - sum(since).
+
+Statystyki sa w pamieci i licza sie od startu serwera.
+"""
+import threading
+from time import time
+
+BUCKET_SECONDS = 3600   # kubelki godzinowe
+BUCKETS = 168           # tydzien historii
+REPORT_BUCKETS = 24     # ile ostatnich kubelkow zwraca report()
+
+
+def _new_locker():
+    return {
+        "deposits": 0,
+        "returns": 0,
+        "locks": 0,
+        "unlocks": 0,
+        "occupied_since": None,
+        "occupied_seconds": 0.0,   # tylko zakonczone zajecia
+        "dwell_seconds": 0.0,
+        "open_since": None,
+        "open_seconds": 0.0,       # tylko zakonczone otwarcia
+        "sensor_closed": None,     # None = jeszcze nie odczytany
+    }
+
+
+class OccupancyAnalytics:
+    def __init__(self, bucket_seconds=BUCKET_SECONDS, buckets=BUCKETS):
+        self.mutex = threading.Lock()
+        self.bucket_seconds = bucket_seconds
+        self.buckets = [None] * buckets
+        self.reset([])
+
+    def reset(self, lockers):
+        """Start liczenia; zajete szafki licza czas zajecia od teraz."""
+        now = time()
+        with self.mutex:
+            self.started = now
+            self.lockers = [_new_locker() for _ in lockers]
+            self.occupancy = 0
+            self.peak_occupancy = 0
+            self.peak_at = None
+            self.occupied_since_sum = 0.0
+            self.occupied_seconds = 0.0
+            self.open_count = 0
+            self.open_since_sum = 0.0
+            self.open_seconds = 0.0
+            self.completed = 0
+            self.dwell_seconds = 0.0
+            self.totals = {"deposits": 0, "returns": 0, "locks": 0, "unlocks": 0}
+            self.buckets = [None] * len(self.buckets)
+            for i, locker in enumerate(lockers):
+                if locker["occupied"]:
+                    self._occupy(i, now)
+
+    # ========== Zdarzenia ==========
+
+    def deposit(self, locker_id):
+        now = time()
+        with self.mutex:
+            if self.lockers[locker_id]["occupied_since"] is not None:
+                return
+            self._count(locker_id, "deposits", now)
+            self._occupy(locker_id, now)
+
+    def release(self, locker_id):
+        now = time()
+        with self.mutex:
+            stats = self.lockers[locker_id]
+            since = stats["occupied_since"]
+            if since is None:
+                return
+            self._count(locker_id, "returns", now)
+            dwell = now - since
+            stats["occupied_since"] = None
+            stats["occupied_seconds"] += dwell
+            stats["dwell_seconds"] += dwell
+            self.occupancy -= 1
+            self.occupied_since_sum -= since
+            self.occupied_seconds += dwell
+            self.completed += 1
+            self.dwell_seconds += dwell
+
+    def lock(self, locker_id):
+        with self.mutex:
+            self._count(locker_id, "locks", time())
+
+    def unlock(self, locker_id):
+        with self.mutex:
+            self._count(locker_id, "unlocks", time())
+
+    def sensor(self, locker_id, closed):
+        now = time()
+        with self.mutex:
+            stats = self.lockers[locker_id]
+            if stats["sensor_closed"] == closed:
+                return
+            stats["sensor_closed"] = closed
+            if not closed:
+                stats["open_since"] = now
+                self.open_count += 1
+                self.open_since_sum += now
+                self._bucket(now)["opens"] += 1
+            elif stats["open_since"] is not None:
+                since = stats["open_since"]
+                stats["open_since"] = None
+                stats["open_seconds"] += now - since
+                self.open_count -= 1
+                self.open_since_sum -= since
+                self.open_seconds += now - since
+
+    def _occupy(self, locker_id, now):
+        self.lockers[locker_id]["occupied_since"] = now
+        self.occupancy += 1
+        self.occupied_since_sum += now
+        if self.occupancy > self.peak_occupancy:
+            self.peak_occupancy = self.occupancy
+            self.peak_at = now
+        bucket = self._bucket(now)
+        bucket["peak_occupancy"] = max(bucket["peak_occupancy"], self.occupancy)
+
+    def _count(self, locker_id, name, now):
+        self.lockers[locker_id][name] += 1
+        self.totals[name] += 1
+        self._bucket(now)[name] += 1
+
+    def _bucket(self, now):
+        start = int(now // self.bucket_seconds) * self.bucket_seconds
+        index = (start // self.bucket_seconds) % len(self.buckets)
+        bucket = self.buckets[index]
+        if bucket is None or bucket["start"] != start:
+            # Nowy kubelek zaczyna z obecna zajetoscia jako szczytem
+            bucket = self.buckets[index] = {
+                "start": start, "deposits": 0, "returns": 0, "locks": 0,
+                "unlocks": 0, "opens": 0, "peak_occupancy": self.occupancy,
+            }
+        return bucket
+
+    # ========== Raporty ==========
+
+    def report(self):
+        now = time()
+        with self.mutex:
+            count = len(self.lockers)
+            elapsed = max(now - self.started, 1e-9)
+            occupied = self.occupied_seconds + self.occupancy * now - self.occupied_since_sum
+            opened = self.open_seconds + self.open_count * now - self.open_since_sum
+
+            # Ostatnie kubelki - stala liczba, niezaleznie od ruchu
+            current = int(now // self.bucket_seconds) * self.bucket_seconds
+            history = []
+            for n in range(REPORT_BUCKETS - 1, -1, -1):
+                start = current - n * self.bucket_seconds
+                bucket = self.buckets[(start // self.bucket_seconds) % len(self.buckets)]
+                if bucket is not None and bucket["start"] == start:
+                    history.append(dict(bucket))
+
+            return {
+                "since": self.started,
+                "lockers": count,
+                "occupancy": self.occupancy,
+                "peak_occupancy": self.peak_occupancy,
+                "peak_at": self.peak_at,
+                "utilization": round(occupied / (count * elapsed), 4) if count else 0.0,
+                "avg_dwell_seconds": round(self.dwell_seconds / self.completed, 1) if self.completed else None,
+                "open_seconds": round(opened, 1),
+                "doors_open": self.open_count,
+                **self.totals,
+                "buckets": history,
+            }
+
+    def locker_report(self, locker_id):
+        now = time()
+        with self.mutex:
+            stats = self.lockers[locker_id]
+            elapsed = max(now - self.started, 1e-9)
+            occupied = stats["occupied_seconds"]
+            if stats["occupied_since"] is not None:
+                occupied += now - stats["occupied_since"]
+            opened = stats["open_seconds"]
+            if stats["open_since"] is not None:
+                opened += now - stats["open_since"]
+            completed = stats["returns"]
+            return {
+                "id": locker_id,
+                "deposits": stats["deposits"],
+                "returns": stats["returns"],
+                "locks": stats["locks"],
+                "unlocks": stats["unlocks"],
+                "occupied": stats["occupied_since"] is not None,
+                "utilization": round(occupied / elapsed, 4),
+                "avg_dwell_seconds": round(stats["dwell_seconds"] / completed, 1) if completed else None,
+                "open_seconds": round(opened, 1),
+            }
@@ -1,5 +1,11 @@
+import random
+import threading
+import time
+import uuid
+
 import requests
 from kivy.app import App
+from kivy.clock import Clock
 from kivy.uix.screenmanager import ScreenManager, Screen
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.button import Button
@@ -7,8 +13,49 @@ from kivy.uix.label import Label
 from kivy.uix.textinput import TextInput
 from kivy.uix.popup import Popup
 
+import encoding
+
 API_URL = "http://192.168.1.27:5000"  # Adres Twojego serwera Flask
 
+REQUEST_TIMEOUT = 5      # sekundy
+RETRIES = 4
+RETRY_BACKOFF = 0.5      # pierwszy odstep, potem x2
+RETRY_STATUSES = (409, 502, 503, 504)
+
+# Kompaktowe formaty odpowiedzi (encoding.py); MessagePack tylko jesli jest zainstalowany
+if encoding.msgpack:
+    ACTION_ACCEPT = f"{encoding.MSGPACK}, {encoding.JSON};q=0.5"
+    LOCKERS_ACCEPT = f"{encoding.PACKED_LOCKERS}, {encoding.MSGPACK};q=0.9, {encoding.JSON};q=0.5"
+else:
+    ACTION_ACCEPT = encoding.JSON
+    LOCKERS_ACCEPT = f"{encoding.PACKED_LOCKERS}, {encoding.JSON};q=0.5"
+
+
+def decode_response(resp):
+    return encoding.decode(resp.headers.get("Content-Type"), resp.content)
+
+
+def post_with_retry(url, idem_key, headers=None, json=None):
+    """
+    POST z naglowkiem Idempotency-Key, powtarzany przy bledach sieci
+    (wykladniczy odstep z losowym rozrzutem). Serwer rozpoznaje powtorke
+    po kluczu i nie rusza szafki drugi raz.
+    """
+    headers = dict(headers or {})
+    headers["Idempotency-Key"] = idem_key
+    headers["Accept"] = ACTION_ACCEPT
+    delay = RETRY_BACKOFF
+    for attempt in range(RETRIES + 1):
+        try:
+            resp = requests.post(url, headers=headers, json=json, timeout=REQUEST_TIMEOUT)
+            if resp.status_code not in RETRY_STATUSES or attempt == RETRIES:
+                return resp
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == RETRIES:
+                raise
+        time.sleep(delay + random.uniform(0, delay / 2))
+        delay *= 2
+
 
 class LoginScreen(Screen):
     def __init__(self, **kwargs):
@@ -136,6 +183,10 @@ class MainScreen(Screen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.token = None
+        # (akcja, locker_id) -> Idempotency-Key akcji, ktora nie dostala odpowiedzi;
+        # ponowne klikniecie uzywa tego samego klucza
+        self.pending_keys = {}
+        self.in_flight = set()   # akcje wysylane w tle
 
         layout = BoxLayout(orientation='vertical', spacing=10, padding=10)
 
@@ -157,8 +208,47 @@ class MainScreen(Screen):
 
     def logout(self, instance):
         self.token = None
+        self.pending_keys = {}
         self.manager.current = "login"
 
+    def post_action(self, action, locker_id, url, headers=None, json=None, done_msg="OK"):
+        """
+        Wysyla akcje w osobnym watku - powtorki przy slabym Wi-Fi moga trwac
+        kilkadziesiat sekund i nie moga zamrozic interfejsu. Wynik wraca do
+        watku UI przez Clock.schedule_once (action_done).
+        """
+        pending = (action, locker_id)
+        if pending in self.in_flight:
+            self.status_label.text = "Request in progress..."
+            return
+        self.in_flight.add(pending)
+        idem_key = self.pending_keys.setdefault(pending, uuid.uuid4().hex)
+        self.status_label.text = "Sending..."
+
+        def worker():
+            try:
+                resp, error = post_with_retry(url, idem_key, headers=headers, json=json), None
+            except requests.RequestException as e:
+                resp, error = None, e
+            Clock.schedule_once(lambda dt: self.action_done(pending, resp, error, done_msg))
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def action_done(self, pending, resp, error, done_msg):
+        self.in_flight.discard(pending)
+        if error is not None:
+            # Klucz zostaje - ponowne klikniecie powtorzy te sama akcje
+            self.status_label.text = f"Network error: {str(error)}"
+            return
+        # Serwer odpowiedzial - kolejne klikniecie to juz nowa akcja
+        self.pending_keys.pop(pending, None)
+        if resp.status_code == 200:
+            data = decode_response(resp)
+            self.status_label.text = data.get("message", done_msg)
+            self.refresh_lockers()
+        else:
+            self.show_error(resp)
+
     def refresh_lockers(self, instance=None):
         self.locker_box.clear_widgets()
         if not self.token:
@@ -166,10 +256,10 @@ class MainScreen(Screen):
             return
 
         try:
-            headers = {"Authorization": f"Bearer {self.token}"}
-            resp = requests.get(f"{API_URL}/lockers", headers=headers)
+            headers = {"Authorization": f"Bearer {self.token}", "Accept": LOCKERS_ACCEPT}
+            resp = requests.get(f"{API_URL}/lockers", headers=headers, timeout=REQUEST_TIMEOUT)
             if resp.status_code == 200:
-                data = resp.json()
+                data = decode_response(resp)
                 lockers = data["lockers"]
                 for locker in lockers:
                     locker_id = locker["id"]
@@ -217,74 +307,38 @@ class MainScreen(Screen):
         if not self.token:
             self.status_label.text = "Not logged in"
             return
-
-        try:
-            headers = {"Authorization": f"Bearer {self.token}"}
-            resp = requests.post(
-                f"{API_URL}/lockers/deposit",
-                headers=headers,
-                json={"locker_id": locker_id}
-            )
-            if resp.status_code == 200:
-                data = resp.json()
-                msg = data.get("message", "Reserved & Opened")
-                self.status_label.text = msg
-                self.refresh_lockers()
-            else:
-                self.show_error(resp)
-        except requests.RequestException as e:
-            self.status_label.text = f"Network error: {str(e)}"
+        headers = {"Authorization": f"Bearer {self.token}"}
+        self.post_action(
+            "deposit", locker_id,
+            f"{API_URL}/lockers/deposit",
+            headers=headers,
+            json={"locker_id": locker_id},
+            done_msg="Reserved & Opened"
+        )
 
     def open_locker(self, locker_id):
         if not self.token:
             self.status_label.text = "Not logged in"
             return
-        try:
-            headers = {"Authorization": f"Bearer {self.token}"}
-            resp = requests.post(f"{API_URL}/lockers/{locker_id}/unlock", headers=headers)
-            if resp.status_code == 200:
-                data = resp.json()
-                msg = data.get("message", "Opened")
-                self.status_label.text = msg
-                self.refresh_lockers()
-            else:
-                self.show_error(resp)
-        except requests.RequestException as e:
-            self.status_label.text = f"Network error: {str(e)}"
+        headers = {"Authorization": f"Bearer {self.token}"}
+        self.post_action("unlock", locker_id, f"{API_URL}/lockers/{locker_id}/unlock",
+                         headers=headers, done_msg="Opened")
 
     def return_locker(self, locker_id):
         if not self.token:
             self.status_label.text = "Not logged in"
             return
-        try:
-            headers = {"Authorization": f"Bearer {self.token}"}
-            resp = requests.post(f"{API_URL}/lockers/{locker_id}/return", headers=headers)
-            if resp.status_code == 200:
-                data = resp.json()
-                msg = data.get("message", "Returned")
-                self.status_label.text = msg
-                self.refresh_lockers()
-            else:
-                self.show_error(resp)
-        except requests.RequestException as e:
-            self.status_label.text = f"Network error: {str(e)}"
+        headers = {"Authorization": f"Bearer {self.token}"}
+        self.post_action("return", locker_id, f"{API_URL}/lockers/{locker_id}/return",
+                         headers=headers, done_msg="Returned")
 
     def close_locker(self, locker_id):
-        try:
-            resp = requests.post(f"{API_URL}/lockers/{locker_id}/lock")
-            if resp.status_code == 200:
-                data = resp.json()
-                msg = data.get("message", "Locker closed")
-                self.status_label.text = msg
-                self.refresh_lockers()
-            else:
-                self.show_error(resp)
-        except requests.RequestException as e:
-            self.status_label.text = f"Network error: {str(e)}"
+        self.post_action("lock", locker_id, f"{API_URL}/lockers/{locker_id}/lock",
+                         done_msg="Locker closed")
 
     def show_error(self, resp):
         try:
-            data = resp.json()
+            data = decode_response(resp)
             err = data.get("message") or data.get("error") or resp.text
             self.status_label.text = f"Error {resp.status_code}: {err}"
         except:
@@ -0,0 +1,67 @@
+"""
+Porownanie formatow odpowiedzi /lockers: JSON, MessagePack i x-surebox-lockers.
+
+    python bench_encoding.py            # 1000 szafek
+    python bench_encoding.py --lockers 5000
+
+Drukuje rozmiar odpowiedzi (surowy i po gzip) oraz sredni czas
+kodowania/dekodowania. Stan szafek jest losowy, ale powtarzalny (seed).
+"""
+import argparse
+import gzip
+import json
+import random
+import timeit
+
+import encoding
+
+
+def sample_lockers(count, seed=1):
+    rnd = random.Random(seed)
+    lockers = []
+    for i in range(count):
+        occupied = rnd.random() < 0.6
+        lockers.append({
+            "id": i,
+            "status": rnd.choice(["locked", "unlocked"]),
+            "occupied": occupied,
+            "closed": rnd.random() < 0.7,
+            "sensor_closed": rnd.random() < 0.7,
+            "owner_id": rnd.randint(1, 100000) if occupied else None,
+        })
+    return lockers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--lockers", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    lockers = sample_lockers(args.lockers)
+    payload = {"lockers": lockers}
+
+    formats = {
+        "json": (lambda: json.dumps(payload).encode(), json.loads),
+        "x-surebox-lockers": (lambda: encoding.encode_lockers(lockers), encoding.decode_lockers),
+    }
+    if encoding.msgpack is not None:
+        formats["msgpack"] = (lambda: encoding.msgpack.packb(payload), encoding.msgpack.unpackb)
+
+    print(f"{args.lockers} szafek, {args.repeat} powtorzen")
+    print(f"{'format':20} {'bajty':>8} {'gzip':>8} {'encode us':>10} {'decode us':>10}")
+    for name, (encode, decode) in formats.items():
+        data = encode()
+        enc_us = timeit.timeit(encode, number=args.repeat) / args.repeat * 1e6
+        dec_us = timeit.timeit(lambda: decode(data), number=args.repeat) / args.repeat * 1e6
+        print(f"{name:20} {len(data):>8} {len(gzip.compress(data)):>8} {enc_us:>10.1f} {dec_us:>10.1f}")
+
+    if encoding.msgpack is None:
+        print("(msgpack nie jest zainstalowany - pominiety)")
+
+    # Kontrola: format binarny musi dac dokladnie to samo co JSON
+    assert encoding.decode_lockers(encoding.encode_lockers(lockers)) == lockers
+
+
+if __name__ == "__main__":
+    main()
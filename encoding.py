@@ -0,0 +1,95 @@
+"""
+Kompaktowe kodowania odpowiedzi API (wspolne dla server.py i app_client.py).
+
+Klient wybiera format naglowkiem Accept:
+  application/x-surebox-lockers - stala dlugosc rekordu, tylko /lockers
+  application/msgpack           - MessagePack, dowolna odpowiedz
+                                  (wymaga pakietu msgpack, inaczej JSON)
+Bez tych typow w Accept odpowiedz jest w JSON, jak dotad. Wage q z Accept
+uwzglednia server.respond() (request.accept_mimetypes.best_match).
+
+Format x-surebox-lockers (little-endian):
+  naglowek: "SBL" + wersja (uint8) + liczba szafek (uint32)
+  rekord:   flagi (uint8) + owner_id (uint32), 5 bajtow na szafke
+Id szafki to numer rekordu. Flagi: FLAG_LOCKED, FLAG_OCCUPIED, FLAG_CLOSED,
+FLAG_SENSOR_CLOSED, FLAG_HAS_OWNER (bez niego owner_id = None).
+"""
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+PACKED_LOCKERS = "application/x-surebox-lockers"
+
+MAGIC = b"SBL"
+VERSION = 1
+HEADER = struct.Struct("<3sBI")
+RECORD = struct.Struct("<BI")
+
+FLAG_LOCKED = 0x01
+FLAG_OCCUPIED = 0x02
+FLAG_CLOSED = 0x04
+FLAG_SENSOR_CLOSED = 0x08
+FLAG_HAS_OWNER = 0x10
+
+
+def encode_lockers(lockers):
+    """lockers - lista slownikow jak w odpowiedzi JSON /lockers, w kolejnosci id."""
+    pack = RECORD.pack
+    parts = [HEADER.pack(MAGIC, VERSION, len(lockers))]
+    for lk in lockers:
+        owner = lk["owner_id"]
+        flags = ((FLAG_LOCKED if lk["status"] == "locked" else 0)
+                 | (FLAG_OCCUPIED if lk["occupied"] else 0)
+                 | (FLAG_CLOSED if lk["closed"] else 0)
+                 | (FLAG_SENSOR_CLOSED if lk["sensor_closed"] else 0)
+                 | (FLAG_HAS_OWNER if owner is not None else 0))
+        parts.append(pack(flags, owner or 0))
+    return b"".join(parts)
+
+
+def decode_lockers(data):
+    """Odwrotnosc encode_lockers - zwraca liste slownikow jak w JSON."""
+    magic, version, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Nieznany format danych szafek")
+    body = memoryview(data)[HEADER.size:HEADER.size + count * RECORD.size]
+    lockers = []
+    for i, (flags, owner) in enumerate(RECORD.iter_unpack(body)):
+        lockers.append({
+            "id": i,
+            "status": "locked" if flags & FLAG_LOCKED else "unlocked",
+            "occupied": bool(flags & FLAG_OCCUPIED),
+            "closed": bool(flags & FLAG_CLOSED),
+            "sensor_closed": bool(flags & FLAG_SENSOR_CLOSED),
+            "owner_id": owner if flags & FLAG_HAS_OWNER else None,
+        })
+    return lockers
+
+
+def offers(packed_available=False):
+    """
+    Formaty, ktore serwer moze zwrocic. JSON pierwszy - przy rownej wadze
+    (np. Accept: */*) wygrywa, wiec przegladarka dalej dostaje JSON.
+    """
+    formats = [JSON]
+    if packed_available:
+        formats.append(PACKED_LOCKERS)
+    if msgpack is not None:
+        formats.append(MSGPACK)
+    return formats
+
+
+def decode(content_type, data):
+    """Dekoduje odpowiedz dowolnego endpointu (po stronie klienta)."""
+    content_type = (content_type or "").split(";")[0].strip()
+    if content_type == PACKED_LOCKERS:
+        return {"lockers": decode_lockers(data)}
+    if content_type == MSGPACK:
+        return msgpack.unpackb(data)
+    return json.loads(data)
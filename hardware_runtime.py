@@ -0,0 +1,133 @@
+"""
+Jedna petla asyncio dla calego sprzetu (czujniki, klawiatura, LCD, serwa).
+
+Petla dziala w osobnym watku. Zadania rejestrowane przez supervise() sa
+nadzorowane - jesli ktores rzuci wyjatek, jest wypisywany i zadanie
+startuje ponownie (z rosnacym odstepem). Watki Flask rozmawiaja z petla
+przez call() / call_soon(), ktore sa bezpieczne miedzy watkami.
+
+stats() zwraca opoznienie petli (lag), liczbe wybudzen petli na sekunde
+i stan nadzorowanych zadan.
+"""
+import asyncio
+import selectors
+import threading
+import traceback
+from time import monotonic, time
+
+LAG_INTERVAL = 1.0       # co ile sekund mierzymy opoznienie petli
+RESTART_DELAY = 0.5      # pierwszy odstep przed restartem zadania
+RESTART_DELAY_MAX = 30.0
+
+
+class _CountingSelector(selectors.DefaultSelector):
+    """
+    Selektor liczacy wybudzenia petli - tylko select, ktory usypia watek.
+    select(0) petla wola zaraz po odpaleniu timera (kolejny krok zadania
+    jest juz gotowy), wiec nie jest osobnym wybudzeniem.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.wakeups = 0
+
+    def select(self, timeout=None):
+        if timeout is None or timeout > 0:
+            self.wakeups += 1
+        return super().select(timeout)
+
+
+class HardwareRuntime:
+    def __init__(self):
+        self.selector = _CountingSelector()
+        self.loop = asyncio.SelectorEventLoop(self.selector)
+        self.thread = None
+        self.tasks = {}
+        self.lag = {"last_ms": 0.0, "max_ms": 0.0, "avg_ms": 0.0, "samples": 0}
+        self.wakeups_per_s = 0.0
+
+    def start(self):
+        self.supervise("lag_monitor", self._lag_monitor)
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True, name="hardware")
+        self.thread.start()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    # ========== Most miedzy watkami ==========
+
+    def call(self, coro_fn, *args, timeout=10):
+        """Uruchamia korutyne w petli i czeka na wynik (z innego watku)."""
+        future = asyncio.run_coroutine_threadsafe(coro_fn(*args), self.loop)
+        return future.result(timeout)
+
+    def call_soon(self, fn, *args):
+        """Wywoluje zwykla funkcje w petli, bez czekania na wynik."""
+        self.loop.call_soon_threadsafe(fn, *args)
+
+    async def run_blocking(self, fn, *args):
+        """Blokujace I/O (np. SQLite) w puli watkow, zeby nie opozniac petli."""
+        return await self.loop.run_in_executor(None, fn, *args)
+
+    # ========== Nadzor zadan ==========
+
+    def supervise(self, name, factory):
+        """
+        Rejestruje zadanie: factory() zwraca korutyne, ktora normalnie
+        dziala bez konca. Mozna wolac przed start() i z dowolnego watku.
+        """
+        self.tasks[name] = {"running": False, "restarts": 0, "last_error": None, "last_error_at": None}
+        self.loop.call_soon_threadsafe(self.loop.create_task, self._supervisor(name, factory))
+
+    async def _supervisor(self, name, factory):
+        info = self.tasks[name]
+        delay = RESTART_DELAY
+        while True:
+            info["running"] = True
+            started = monotonic()
+            try:
+                await factory()
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                info["running"] = False
+                info["restarts"] += 1
+                info["last_error"] = repr(e)
+                info["last_error_at"] = time()
+                print(f"[hardware] zadanie '{name}' padlo, restart za {delay:.1f} s")
+                traceback.print_exc()
+                # Zadanie, ktore dzialalo dlugo, zaczyna znow od krotkiego odstepu
+                if monotonic() - started > RESTART_DELAY_MAX:
+                    delay = RESTART_DELAY
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RESTART_DELAY_MAX)
+            finally:
+                info["running"] = False
+
+    # ========== Pomiary ==========
+
+    async def _lag_monitor(self):
+        last_wakeups = self.selector.wakeups
+        while True:
+            start = monotonic()
+            await asyncio.sleep(LAG_INTERVAL)
+            elapsed = monotonic() - start
+            lag_ms = max(0.0, (elapsed - LAG_INTERVAL) * 1000)
+
+            lag = self.lag
+            lag["samples"] += 1
+            lag["last_ms"] = round(lag_ms, 3)
+            lag["max_ms"] = round(max(lag["max_ms"], lag_ms), 3)
+            lag["avg_ms"] = round(lag["avg_ms"] + (lag_ms - lag["avg_ms"]) / lag["samples"], 3)
+
+            wakeups = self.selector.wakeups
+            self.wakeups_per_s = round((wakeups - last_wakeups) / elapsed, 2)
+            last_wakeups = wakeups
+
+    def stats(self):
+        return {
+            "lag": dict(self.lag),
+            "wakeups_per_s": self.wakeups_per_s,
+            "tasks": {name: dict(info) for name, info in self.tasks.items()},
+        }
@@ -0,0 +1,72 @@
+"""
+Pamiec wynikow zapytan z naglowkiem Idempotency-Key.
+
+Klient wysyla ten sam klucz przy kazdej powtorce tej samej akcji.
+Pierwsze zapytanie wykonuje akcje i zapisuje odpowiedz, kolejne z tym
+samym kluczem dostaja zapisana odpowiedz - serwo nie rusza sie drugi raz.
+Jesli oryginal jeszcze trwa, powtorka czeka na jego wynik.
+
+Pamiec jest ograniczona (MAX_ENTRIES) i wpisy wygasaja po TTL sekundach.
+"""
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+MAX_ENTRIES = 4096
+TTL = 600          # sekundy
+WAIT_TIMEOUT = 15  # ile powtorka czeka na trwajacy oryginal
+
+
+class IdempotencyCache:
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()   # klucz -> wpis, w kolejnosci wygasania
+        self.lock = threading.Lock()
+
+    def begin(self, key, fingerprint):
+        """
+        Zwraca (wpis, True) jesli to pierwsze zapytanie z tym kluczem -
+        wtedy trzeba wykonac akcje i wywolac finish()/abort().
+        Dla powtorki zwraca (wpis, False).
+        """
+        now = monotonic()
+        with self.lock:
+            self._expire(now)
+            entry = self.entries.get(key)
+            if entry is not None:
+                return entry, False
+            entry = {
+                "fingerprint": fingerprint,
+                "expires": now + self.ttl,
+                "done": threading.Event(),
+                "response": None,
+            }
+            self.entries[key] = entry
+            # Ograniczona pamiec - wyrzucamy najstarsze
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return entry, True
+
+    def finish(self, key, entry, response):
+        entry["response"] = response
+        entry["done"].set()
+
+    def abort(self, key, entry):
+        """Akcja sie nie udala (wyjatek / blad serwera) - powtorka wykona ja od nowa."""
+        with self.lock:
+            if self.entries.get(key) is entry:
+                del self.entries[key]
+        entry["done"].set()
+
+    def wait(self, entry, timeout=WAIT_TIMEOUT):
+        """Odpowiedz oryginalu albo None, jesli nie skonczyl sie w czasie / przerwano go."""
+        entry["done"].wait(timeout)
+        return entry["response"]
+
+    def _expire(self, now):
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if entry["expires"] > now:
+                break
+            self.entries.popitem(last=False)
@@ -0,0 +1,204 @@
+"""
+Masowe zakladanie uzytkownikow (import) i eksport - CSV albo JSON-lines.
+
+CSV ma naglowek username,password,code; JSON-lines to jeden obiekt
+{"username": ..., "password": ..., "code": ...} na linie. Dane sa czytane
+strumieniowo, wiec rozmiar pliku nie ma znaczenia.
+
+Import idzie paczkami: cala paczka jednym executemany w jednej transakcji.
+Jesli w paczce jest blad (np. istniejacy user), paczka jest wycofywana
+i powtarzana wiersz po wierszu, zeby zapisac dobre i zglosic zle wiersze.
+
+Uzywane przez server.py (/users/bulk, /users/export) i z linii polecen:
+
+    python provision.py import users.csv
+    python provision.py import users.jsonl --db lockers.db
+    python provision.py export --format csv > users.csv
+
+Eksport zawiera tylko username i code - hasel nie wypuszczamy z bazy,
+wiec eksportu nie da sie wprost zaimportowac z powrotem.
+"""
+import argparse
+import csv
+import io
+import json
+import sqlite3
+import sys
+
+BATCH_SIZE = 1000
+MAX_ERRORS = 1000   # tyle bledow zwracamy szczegolowo, reszta tylko w liczniku
+FIELDS = ("username", "password", "code")
+EXPORT_FIELDS = ("username", "code")
+
+
+def validate_user(username, password, code):
+    """Zwraca opis bledu albo None. Kod jest opcjonalny, ale jesli jest - 4 cyfry."""
+    if not username or not password:
+        return "Missing user/pass"
+    if code is not None and not (isinstance(code, str) and len(code) == 4 and code.isdigit()):
+        return "Code must be 4 digits"
+    return None
+
+
+def detect_format(name):
+    """Format z rozszerzenia pliku, content-type albo parametru format."""
+    name = (name or "").lower()
+    return "csv" if "csv" in name else "jsonl"
+
+
+def parse_rows(stream, fmt):
+    """
+    Czyta strumien tekstowy i dla kazdego wiersza zwraca
+    (nr_linii, (user, blad)); user to krotka (username, password, code).
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, user_from(row)
+    else:
+        for line_no, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield line_no, (None, "Invalid JSON")
+                continue
+            if not isinstance(row, dict):
+                yield line_no, (None, "Expected JSON object")
+                continue
+            yield line_no, user_from(row)
+
+
+def user_from(row):
+    """
+    Normalizuje slownik usera (wiersz importu albo body /register):
+    zwraca ((username, password, code), None) albo (None, blad).
+    Pusty kod oznacza brak kodu. Liczby (np. username 7 z JSON) zamieniamy
+    na tekst, listy/slowniki/bool to blad wiersza.
+    """
+    fields = {}
+    for name in FIELDS:
+        value = row.get(name)
+        if value is None or isinstance(value, str):
+            fields[name] = value
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            fields[name] = str(value)
+        else:
+            return None, "Invalid field type"
+    username = (fields["username"] or "").strip()
+    password = fields["password"] or ""
+    code = fields["code"]
+    if code is not None:
+        code = code.strip() or None
+    error = validate_user(username, password, code)
+    if error:
+        return None, error
+    return (username, password, code), None
+
+
+def import_users(db_name, rows, batch_size=BATCH_SIZE):
+    """
+    rows - wynik parse_rows(). Zwraca podsumowanie:
+    {"inserted": n, "failed": n, "errors": [{"line": n, "error": "..."}]}
+    """
+    summary = {"inserted": 0, "failed": 0, "errors": []}
+
+    def fail(line_no, error):
+        summary["failed"] += 1
+        if len(summary["errors"]) < MAX_ERRORS:
+            summary["errors"].append({"line": line_no, "error": error})
+
+    # isolation_level=None - transakcje otwieramy sami, jedna na paczke
+    conn = sqlite3.connect(db_name, isolation_level=None)
+    c = conn.cursor()
+    insert = "INSERT INTO users(username,password,code) VALUES(?,?,?)"
+
+    def flush(batch):
+        c.execute("BEGIN")
+        try:
+            c.executemany(insert, [user for _, user in batch])
+            c.execute("COMMIT")
+            summary["inserted"] += len(batch)
+            return
+        except sqlite3.Error:
+            # Niektore bledy SQLite same wycofuja transakcje
+            if conn.in_transaction:
+                c.execute("ROLLBACK")
+
+        c.execute("BEGIN")
+        for line_no, user in batch:
+            try:
+                c.execute(insert, user)
+                summary["inserted"] += 1
+            except sqlite3.IntegrityError:
+                fail(line_no, "User exists")
+            except sqlite3.Error as e:
+                fail(line_no, f"Database error: {e}")
+        c.execute("COMMIT")
+
+    batch = []
+    try:
+        for line_no, (user, error) in rows:
+            if error:
+                fail(line_no, error)
+                continue
+            batch.append((line_no, user))
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+    finally:
+        conn.close()
+    return summary
+
+
+def export_users(db_name, fmt):
+    """Generator kolejnych linii eksportu (nie laduje calej tabeli do pamieci)."""
+    conn = sqlite3.connect(db_name)
+    try:
+        c = conn.cursor()
+        c.execute("SELECT username, code FROM users ORDER BY id")
+        if fmt == "csv":
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            writer.writerow(EXPORT_FIELDS)
+            for row in c:
+                writer.writerow(row)
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        else:
+            for row in c:
+                yield json.dumps(dict(zip(EXPORT_FIELDS, row))) + "\n"
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import/eksport uzytkownikow SureBox")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("file", nargs="?", help="plik do importu (- = stdin)")
+    parser.add_argument("--db", default="lockers.db")
+    parser.add_argument("--format", choices=["csv", "jsonl"])
+    args = parser.parse_args()
+
+    if args.command == "import":
+        if not args.file:
+            parser.error("import wymaga pliku")
+        fmt = args.format or detect_format(args.file)
+        if args.file == "-":
+            summary = import_users(args.db, parse_rows(sys.stdin, fmt))
+        else:
+            with open(args.file, newline="", encoding="utf-8") as f:
+                summary = import_users(args.db, parse_rows(f, fmt))
+        print(json.dumps(summary, indent=2))
+        sys.exit(1 if summary["failed"] else 0)
+    else:
+        for chunk in export_users(args.db, args.format or "jsonl"):
+            sys.stdout.write(chunk)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Odtwarzanie sladu nagranego przez tracing.py na symulowanym sprzecie.
+
+    python replay.py slad.gz              # w czasie rzeczywistym (1x)
+    python replay.py slad.gz --speed 20   # 20x szybciej
+
+Serwer startuje z kopii bazy z chwili nagrania (slad.gz.db) i z ta sama
+topologia. Zapytania HTTP, klawisze i zmiany czujnikow sa podawane
+w tej samej kolejnosci i odstepach (podzielonych przez --speed), rowniez
+wszystkie odczekania w server.py (TIME_SCALE) sa przyspieszane.
+
+Na koncu drukowany jest raport: opoznienia endpointow (nagrane vs
+odtworzone), rozne kody odpowiedzi i rozbieznosci koncowego stanu szafek.
+Kod wyjscia 1 oznacza rozbieznosci - mozna tego uzyc jako testu
+regresji wydajnosci na prawdziwym ruchu.
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+from time import perf_counter, sleep
+
+import simulator
+import tracing
+
+# pole w zdarzeniu "locker" -> pole w server.LOCKERS
+LOCKER_FIELDS = {"status": "status", "occupied": "occupied", "closed": "closed", "owner": "owner_id"}
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def endpoint_name(method, path):
+    return f"{method} {re.sub(r'/[0-9]+', '/<id>', path.split('?')[0])}"
+
+
+def wait_for(condition, timeout):
+    deadline = perf_counter() + timeout
+    while not condition():
+        if perf_counter() > deadline:
+            return False
+        sleep(0.001)
+    return True
+
+
+def replay(trace_path, speed=1.0):
+    events = tracing.load(trace_path)
+    if not events or events[0]["k"] != "start":
+        raise ValueError("Slad bez zdarzenia 'start'")
+    start = events[0]
+
+    # Kopia bazy i topologia z chwili nagrania
+    workdir = tempfile.mkdtemp(prefix="surebox-replay-")
+    db_path = os.path.join(workdir, "lockers.db")
+    shutil.copy(tracing.snapshot_path(trace_path), db_path)
+    topology_path = os.path.join(workdir, "topology.json")
+    with open(topology_path, "w") as f:
+        json.dump(start["topology"], f)
+    os.environ["SUREBOX_TOPOLOGY"] = topology_path
+    os.environ.pop("SUREBOX_TRACE", None)
+
+    hw = simulator.install()
+    import server
+
+    server.DB_NAME = db_path
+    server.TIME_SCALE = 1 / speed
+    hw.attach_keypad(server.ROWS, server.COLS, server.KEYPAD)
+    server.init_db()
+    # Drzwi jak w chwili nagrania - uzgadnianie po starcie musi dac ten sam stan
+    initial = next((ev for ev in events if ev["k"] == "reconcile"), None)
+    if initial is not None:
+        slots = server.locker_slots(server.TOPOLOGY)
+        for (servo_slot, sensor_slot), closed in zip(slots, initial["sensors"]):
+            hw.set_slot(sensor_slot, closed)
+    server.start_hardware()
+    client = server.app.test_client()
+
+    # Hasla i kody w sladzie sa zamaskowane - prawdziwe wartosci userow
+    # z kopii bazy. Userzy zalozeni w trakcie nagrania dostaja zastepcze
+    # (te same przy rejestracji i logowaniu), ich kodu z klawiatury nie odtworzymy.
+    key = tracing.snapshot_key(trace_path)
+    secrets = {}
+    token_map = {}      # HMAC tokenu z nagrania -> token z odtworzenia
+    conn = sqlite3.connect(db_path)
+    for password, code, token in conn.execute("SELECT password, code, token FROM users"):
+        secrets[tracing.redact(password, key)] = password
+        if code is not None:
+            secrets[tracing.redact(code, key)] = code
+        # Tokeny sprzed nagrania (klient trzyma token miedzy sesjami)
+        if token is not None:
+            token_map[tracing.redact(token, key)] = token
+    conn.close()
+
+    def restore(body):
+        if body is None:
+            return None
+        if not isinstance(body, dict):
+            return json.dumps(body)
+        body = dict(body)
+        for field in ("password", "code"):
+            value = body.get(field)
+            if isinstance(value, str) and value.startswith(tracing.REDACTED):
+                fallback = value if field == "password" else f"{int(value[2:], 16) % 10000:04d}"
+                body[field] = secrets.setdefault(value, fallback)
+        return json.dumps(body)
+
+    latencies = {}      # endpoint -> ([nagrane ms], [odtworzone ms])
+    status_diffs = []
+    expected = {}       # id szafki -> ostatni nagrany stan
+    timeouts = 0
+    step_timeout = 5.0
+
+    t_start = perf_counter()
+    for ev in events[1:]:
+        # Zdarzenie http jest zapisywane po odpowiedzi - startujemy je
+        # w chwili, w ktorej zapytanie przyszlo
+        at = ev["t"] - ev.get("ms", 0)
+        delay = at / 1000 / speed - (perf_counter() - t_start)
+        if delay > 0:
+            sleep(delay)
+
+        kind = ev["k"]
+        if kind == "http":
+            headers = {}
+            auth = ev.get("auth")
+            if auth:
+                headers["Authorization"] = "Bearer " + token_map.get(auth, auth)
+            t0 = perf_counter()
+            resp = client.open(ev["path"], method=ev["method"], data=restore(ev.get("body")),
+                               headers=headers, content_type=ev.get("ctype"))
+            ms = (perf_counter() - t0) * 1000
+
+            name = endpoint_name(ev["method"], ev["path"])
+            recorded, replayed = latencies.setdefault(name, ([], []))
+            recorded.append(ev["ms"])
+            replayed.append(ms)
+            if resp.status_code != ev["status"]:
+                status_diffs.append((ev["t"], name, ev["status"], resp.status_code))
+
+            # Login daje nowy losowy token - kolejne zapytania musza uzyc nowego
+            old = ev.get("resp")
+            new = resp.get_json(silent=True)
+            if isinstance(old, dict) and isinstance(new, dict) and old.get("token") and new.get("token"):
+                token_map[old["token"]] = new["token"]
+
+        elif kind == "key":
+            hw.press(tracing.unredact_key(ev, key) if "n" in ev else ev["key"])
+            if not hw.wait_keys(step_timeout):
+                timeouts += 1
+
+        elif kind == "sensor":
+            locker = server.LOCKERS[ev["id"]]
+            hw.set_sensor(locker["sensor"], ev["closed"])
+            if not wait_for(lambda: locker["sensor_closed"] == ev["closed"], step_timeout):
+                timeouts += 1
+
+        elif kind == "locker":
+            expected[ev["id"]] = ev
+
+    # Dajemy watkom dokonczyc rozpoczete akcje (komunikaty LCD itp.)
+    sleep(3 / speed)
+    wall = perf_counter() - t_start
+
+    divergences = []
+    for locker_id, ev in sorted(expected.items()):
+        locker = server.LOCKERS[locker_id]
+        for trace_field, field in LOCKER_FIELDS.items():
+            if locker[field] != ev[trace_field]:
+                divergences.append((locker_id, field, ev[trace_field], locker[field]))
+
+    return {
+        "events": len(events) - 1,
+        "speed": speed,
+        "recorded_s": events[-1]["t"] / 1000,
+        "replay_s": round(wall, 3),
+        "endpoints": {
+            name: {
+                "count": len(rec),
+                "recorded_p50_ms": percentile(rec, 50),
+                "recorded_p95_ms": percentile(rec, 95),
+                "replay_p50_ms": round(percentile(rep, 50), 2),
+                "replay_p95_ms": round(percentile(rep, 95), 2),
+            }
+            for name, (rec, rep) in sorted(latencies.items())
+        },
+        "status_diffs": status_diffs,
+        "divergences": divergences,
+        "timeouts": timeouts,
+    }
+
+
+def print_report(report):
+    print(f"Zdarzenia: {report['events']}, nagranie {report['recorded_s']:.1f} s, "
+          f"odtworzenie {report['replay_s']:.1f} s (x{report['speed']})")
+    print(f"{'endpoint':32} {'n':>6} {'nagr. p50':>10} {'nagr. p95':>10} {'repl. p50':>10} {'repl. p95':>10}")
+    for name, s in report["endpoints"].items():
+        print(f"{name:32} {s['count']:>6} {s['recorded_p50_ms']:>10.2f} {s['recorded_p95_ms']:>10.2f} "
+              f"{s['replay_p50_ms']:>10.2f} {s['replay_p95_ms']:>10.2f}")
+    for t, name, old, new in report["status_diffs"]:
+        print(f"Status {name} @ {t} ms: nagrany {old}, odtworzony {new}")
+    for locker_id, field, old, new in report["divergences"]:
+        print(f"Szafka {locker_id + 1}: {field} nagrane={old} odtworzone={new}")
+    if report["timeouts"]:
+        print(f"Zdarzen bez reakcji serwera: {report['timeouts']}")
+    if not report["divergences"]:
+        print("Koncowy stan szafek zgodny z nagraniem")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Odtwarzanie sladu SureBox na symulowanym sprzecie")
+    parser.add_argument("trace", help="plik sladu (SUREBOX_TRACE)")
+    parser.add_argument("--speed", type=float, default=1.0, help="przyspieszenie, np. 10")
+    parser.add_argument("--json", action="store_true", help="raport jako JSON")
+    args = parser.parse_args()
+
+    report = replay(args.trace, args.speed)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    sys.exit(1 if report["divergences"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,40 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, make_response
 from flask_cors import CORS
 from RPLCD.i2c import CharLCD
 import pigpio
-import threading
-from time import sleep
+import asyncio
 import RPi.GPIO as GPIO
 import sqlite3
 import random
 import hashlib  # do generowania tokenu
+import io
+import os
+import threading
 from functools import wraps
+from time import perf_counter, monotonic
+from topology import DEFAULT_TOPOLOGY, load_topology, locker_slots, build_hardware, read_sensors
+from hardware_runtime import HardwareRuntime
+from analytics import OccupancyAnalytics
+from idempotency import IdempotencyCache
+from waitlist import Waitlist, POLL_INTERVAL as WAITLIST_POLL_INTERVAL
+import encoding
+import provision
+import tracing
 
 app = Flask(__name__)
 CORS(app)
 
 DB_NAME = "lockers.db"
+ADMIN_KEY = os.environ.get("SUREBOX_ADMIN_KEY")
 LOCKERS = []
-ROWS = [17, 27, 22, 23]
-COLS = [5, 6, 13, 19]
-KEYPAD = [
-    ["1", "2", "3", "A"],
-    ["4", "5", "6", "B"],
-    ["7", "8", "9", "C"],
-    ["*", "0", "#", "D"]
-]
+ANALYTICS = OccupancyAnalytics()
+IDEMPOTENCY = IdempotencyCache()
+WAITLIST = Waitlist()
+LOCKERS_LOCK = threading.Lock()   # zajmowanie/zwalnianie szafek (deposit, return, kolejka)
+TOPOLOGY = load_topology()
+ROWS = TOPOLOGY["keypad"]["rows"]
+COLS = TOPOLOGY["keypad"]["cols"]
+KEYPAD = TOPOLOGY["keypad"]["keys"]
 
 lcd = None
 pi = None
@@ -42,6 +54,57 @@ def require_auth(func):
         return func(*args, **kwargs)
     return wrapper
 
+# ========== Dekorator administratora (X-Admin-Key) ==========
+def require_admin(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        # Bez SUREBOX_ADMIN_KEY endpointy administracyjne sa wylaczone
+        if not ADMIN_KEY or request.headers.get("X-Admin-Key") != ADMIN_KEY:
+            return jsonify({"error": "Brak uprawnien administratora"}), 403
+        return func(*args, **kwargs)
+    return wrapper
+
+# ========== Dekorator idempotencji (Idempotency-Key) ==========
+def idempotent(func):
+    """
+    Powtorka zapytania z tym samym Idempotency-Key dostaje zapisana
+    odpowiedz oryginalu, bez ponownego ruszania sprzetu.
+    Stosowac pod @require_auth - klucze sa osobne dla kazdego usera.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        idem_key = request.headers.get("Idempotency-Key")
+        if not idem_key:
+            return func(*args, **kwargs)
+
+        user = getattr(request, "current_user", None)
+        key = (user["id"] if user else None, request.method, request.path, idem_key)
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        entry, first = IDEMPOTENCY.begin(key, fingerprint)
+
+        if not first:
+            if entry["fingerprint"] != fingerprint:
+                return jsonify({"success": False, "message": "Idempotency-Key uzyty z innymi danymi"}), 422
+            cached = IDEMPOTENCY.wait(entry)
+            if cached is None:
+                return jsonify({"success": False, "message": "Zapytanie w toku, sprobuj ponownie"}), 409
+            status, body, mimetype = cached
+            response = Response(body, status=status, mimetype=mimetype)
+            response.headers["Idempotent-Replayed"] = "true"
+            return response
+
+        try:
+            response = make_response(func(*args, **kwargs))
+        except Exception:
+            IDEMPOTENCY.abort(key, entry)
+            raise
+        if response.status_code >= 500:
+            IDEMPOTENCY.abort(key, entry)
+        else:
+            IDEMPOTENCY.finish(key, entry, (response.status_code, response.get_data(), response.mimetype))
+        return response
+    return wrapper
+
 # ========== Inicjalizacja bazy i wczytanie do LOCKERS ==========
 
 def init_db():
@@ -81,6 +144,7 @@ def init_db():
         conn.commit()
 
     # Przykladowe lockers, jesli brak
+    slots = locker_slots(TOPOLOGY)
     c.execute("SELECT COUNT(*) FROM lockers")
     if c.fetchone()[0] == 0:
         default_lockers = [
@@ -92,15 +156,26 @@ def init_db():
         c.executemany("""
             INSERT INTO lockers (id, servo_pin, sensor_pin, status, occupied, closed, owner_id)
             VALUES (?,?,?,?,?,?,?)
-        """, default_lockers)
+        """, default_lockers[:len(slots)])
         conn.commit()
 
+    # Topologia moze miec wiecej szafek niz baza - dopisujemy wolne,
+    # a numery pinow zawsze bierzemy z topologii
+    c.executemany("""
+        INSERT OR IGNORE INTO lockers (id, servo_pin, sensor_pin, status, occupied, closed, owner_id)
+        VALUES (?,?,?,'unlocked',0,0,NULL)
+    """, [(i, servo[3], sensor[3]) for i, (servo, sensor) in enumerate(slots)])
+    c.executemany("UPDATE lockers SET servo_pin=?, sensor_pin=? WHERE id=?",
+                  [(servo[3], sensor[3], i) for i, (servo, sensor) in enumerate(slots)])
+    conn.commit()
+
     # Wczytanie lockers do listy LOCKERS w Pythonie
     c.execute("""
         SELECT id, servo_pin, sensor_pin, status, occupied, closed, owner_id
         FROM lockers
+        WHERE id < ?
         ORDER BY id
-    """)
+    """, (len(slots),))
     rows = c.fetchall()
     conn.close()
 
@@ -112,8 +187,16 @@ def init_db():
             "occupied": bool(row[4]),
             "closed": bool(row[5]),
             "owner_id": row[6],
-            "sensor_closed": False
+            "sensor_closed": False,
+            "servo": None,   # obiekty sprzetu, ustawiane w attach_hardware()
+            "sensor": None
         })
+    ANALYTICS.reset(LOCKERS)
+
+def attach_hardware():
+    for locker, (servo, sensor) in zip(LOCKERS, build_hardware(pi, TOPOLOGY)):
+        locker["servo"] = servo
+        locker["sensor"] = sensor
 
 def update_locker_in_db(locker_id):
     locker = LOCKERS[locker_id]
@@ -132,6 +215,9 @@ def update_locker_in_db(locker_id):
     ))
     conn.commit()
     conn.close()
+    tracing.record("locker", id=locker_id, status=locker["status"],
+                   occupied=locker["occupied"], closed=locker["closed"],
+                   owner=locker["owner_id"])
 
 # ========== Obsługa tokenów i haseł ==========
 
@@ -150,39 +236,188 @@ def get_user_by_token(token):
     return None
 
 # ========== Sterowanie serwem i czujnikami ==========
+# Wszystko, co dotyka sprzetu, dziala w jednej petli asyncio (runtime).
+# Watki Flask wolaja unlock_locker/lock_locker, ktore zlecaja prace petli.
+
+SENSOR_INTERVAL = 0.3
+KEY_SETTLE = 0.02
+UNLOCK_ANGLE = 130
+LOCK_ANGLE = 30
+TIME_SCALE = 1.0   # replay.py przyspiesza czas (np. 0.05 = 20x szybciej)
+
+runtime = HardwareRuntime()
+lcd_queue = None   # asyncio.Queue, tworzona w lcd_task
+key_event = None   # asyncio.Event, ustawiany przez zbocze na kolumnie klawiatury
+mask_keys = False  # cyfry kodu nie trafiaja do sladu jawnie (menu enter_code)
 
-def set_angle(angle, servo_pin):
+def pause(seconds):
+    return asyncio.sleep(seconds * TIME_SCALE)
+
+def set_angle(angle, servo):
     pulse = 500 + (angle/180)*2000
-    pi.set_servo_pulsewidth(servo_pin, pulse)
+    servo.set_pulsewidth(pulse)
 
-def unlock_locker(locker_id):
+async def actuate(locker_id, status):
     locker = LOCKERS[locker_id]
-    set_angle(130, locker["servo_pin"])
-    locker["status"] = "unlocked"
-    locker["closed"] = False
-    update_locker_in_db(locker_id)
-    lcd.clear()
-    lcd.write_string(f"Szafka {locker_id+1}\notwarta")
-    sleep(2)
-    lcd.clear()
+    if status == "unlocked":
+        set_angle(UNLOCK_ANGLE, locker["servo"])
+        message = "otwarta"
+    else:
+        set_angle(LOCK_ANGLE, locker["servo"])
+        message = "zamknieta"
+    locker["status"] = status
+    locker["closed"] = (status == "locked")
+    if status == "unlocked":
+        ANALYTICS.unlock(locker_id)
+    else:
+        ANALYTICS.lock(locker_id)
+    await runtime.run_blocking(update_locker_in_db, locker_id)
+    lcd_show(f"Szafka {locker_id+1}\n{message}", 2)
+
+def unlock_locker(locker_id):
+    runtime.call(actuate, locker_id, "unlocked")
 
 def lock_locker(locker_id):
-    locker = LOCKERS[locker_id]
-    set_angle(30, locker["servo_pin"])
-    locker["status"] = "locked"
-    locker["closed"] = True
-    update_locker_in_db(locker_id)
-    lcd.clear()
-    lcd.write_string(f"Szafka {locker_id+1}\nzamknieta")
-    sleep(2)
-    lcd.clear()
+    runtime.call(actuate, locker_id, "locked")
 
-def sensor_thread():
+async def sensor_task():
+    first_read = True
     while True:
-        for i, locker in enumerate(LOCKERS):
-            closed = (GPIO.input(locker["sensor_pin"]) == GPIO.HIGH)
+        # Jeden odczyt na port (GPIO / ekspander), nie na kazdy pin
+        states = read_sensors([locker["sensor"] for locker in LOCKERS])
+        for i, (locker, closed) in enumerate(zip(LOCKERS, states)):
+            if closed != locker["sensor_closed"]:
+                tracing.record("sensor", id=i, closed=closed)
+            if closed != locker["sensor_closed"] or first_read:
+                ANALYTICS.sensor(i, closed)
             locker["sensor_closed"] = closed
-        sleep(0.3)
+        first_read = False
+        await pause(SENSOR_INTERVAL)
+
+# ========== Uzgadnianie stanu po starcie ==========
+# Po zaniku zasilania baza moze mowic "zamknieta", a drzwi sa otwarte,
+# albo serwo zdazylo sie ruszyc, a zapis do bazy juz nie (actuate rusza
+# serwem przed zapisem). Przed przyjeciem pierwszego zapytania czytamy
+# wszystkie czujniki naraz, poprawiamy stan i ustawiamy serwa w pozycje
+# z bazy paczkami (kilka serw naraz to skok pradu, wszystkie naraz moga
+# zresetowac zasilacz). drive_all=False rusza tylko szafki niezgodne.
+
+RECONCILE = {**DEFAULT_TOPOLOGY["reconcile"], **TOPOLOGY.get("reconcile", {})}
+RECONCILE_GRACE = 5   # sekundy ponad timeout na odczyt czujnikow i zapis do bazy
+READY = threading.Event()   # ustawiany po uzgodnieniu - wczesniej API zwraca 503
+RECONCILE_REPORT = {}
+
+def update_lockers_in_db(locker_ids):
+    """Jak update_locker_in_db, ale wiele szafek w jednej transakcji."""
+    conn = sqlite3.connect(DB_NAME)
+    with conn:
+        conn.executemany("""
+            UPDATE lockers
+            SET status=?, occupied=?, closed=?, owner_id=?
+            WHERE id=?
+        """, [(LOCKERS[i]["status"], LOCKERS[i]["occupied"], LOCKERS[i]["closed"],
+               LOCKERS[i]["owner_id"], i) for i in locker_ids])
+    conn.close()
+    for i in locker_ids:
+        locker = LOCKERS[i]
+        tracing.record("locker", id=i, status=locker["status"],
+                       occupied=locker["occupied"], closed=locker["closed"],
+                       owner=locker["owner_id"])
+
+async def reconcile():
+    cfg = RECONCILE
+    started = monotonic()
+    deadline = started + cfg["timeout"] * TIME_SCALE
+    lcd_show("Uruchamianie...\nsprawdzam szafki")
+
+    states = read_sensors([locker["sensor"] for locker in LOCKERS])
+    mismatches = []
+    to_drive = []
+    others = []
+    for i, (locker, closed) in enumerate(zip(LOCKERS, states)):
+        locker["sensor_closed"] = closed
+        if locker["status"] == "locked" and not closed:
+            # Otwartych drzwi nie da sie zamknac - szafka zostaje otwarta
+            mismatches.append({"id": i, "persisted": "locked", "sensor_closed": False,
+                               "action": "unlocked"})
+            locker["status"] = "unlocked"
+            locker["closed"] = False
+            to_drive.append(i)
+        elif cfg["drive_all"]:
+            others.append(i)
+    to_drive += others   # niezgodne szafki najpierw, zeby termin ich nie pominal
+    tracing.record("reconcile", sensors=states, mismatches=[m["id"] for m in mismatches])
+    if mismatches:
+        await runtime.run_blocking(update_lockers_in_db, [m["id"] for m in mismatches])
+
+    # Serwa paczkami po servo_batch; czego nie zdazymy przed terminem,
+    # zostaje w raporcie i ustawi sie przy nastepnym otwarciu/zamknieciu
+    batch_size = max(1, int(cfg["servo_batch"]))
+    driven = 0
+    batches = 0
+    skipped = []
+    for start in range(0, len(to_drive), batch_size):
+        if monotonic() + cfg["settle"] * TIME_SCALE > deadline:
+            skipped = to_drive[start:]
+            break
+        for i in to_drive[start:start + batch_size]:
+            angle = UNLOCK_ANGLE if LOCKERS[i]["status"] == "unlocked" else LOCK_ANGLE
+            set_angle(angle, LOCKERS[i]["servo"])
+            driven += 1
+        batches += 1
+        await pause(cfg["settle"])
+
+    RECONCILE_REPORT.update({
+        "lockers": len(LOCKERS),
+        "doors_open": states.count(False),
+        "mismatches": mismatches,
+        "servos_driven": driven,
+        "batches": batches,
+        "skipped": skipped,
+        "seconds": round(monotonic() - started, 2),
+    })
+    print(f"Uzgadnianie: {len(LOCKERS)} szafek, {len(mismatches)} niezgodnosci, "
+          f"{driven} serw w {batches} paczkach, pominiete {len(skipped)}, "
+          f"{RECONCILE_REPORT['seconds']} s")
+
+async def reconcile_bounded():
+    """reconcile z twardym terminem - po nim korutyna jest anulowana w petli."""
+    await asyncio.wait_for(reconcile(), (RECONCILE["timeout"] + RECONCILE_GRACE) * TIME_SCALE)
+
+# ========== LCD ==========
+
+def lcd_write(message):
+    lcd.clear()
+    lines = message.split("\n")[:2]
+    for i, line in enumerate(lines):
+        lcd.cursor_pos = (i, 0)
+        lcd.write_string(line.ljust(16))
+
+def lcd_show(message, seconds=None):
+    """
+    Wolane z petli sprzetu. Bez seconds - ekran menu (zostaje na LCD),
+    z seconds - komunikat na chwile, potem wraca ekran menu.
+    """
+    if lcd_queue is not None:
+        lcd_queue.put_nowait((message, seconds))
+
+async def lcd_task():
+    global lcd_queue
+    lcd_queue = asyncio.Queue()
+    screen = None
+    shown = None
+    while True:
+        message, seconds = await lcd_queue.get()
+        if seconds is None:
+            screen = message
+        if message != shown:
+            lcd_write(message)
+            shown = message
+        if seconds:
+            await pause(seconds)
+            if lcd_queue.empty() and screen is not None and screen != shown:
+                lcd_write(screen)
+                shown = screen
 
 import sqlite3
 
@@ -221,57 +456,99 @@ def check_code(entered_code, locker_id):
 
 
 def read_keypad():
+    """
+    Skanuje matryce wiersz po wierszu. W spoczynku wszystkie wiersze sa
+    w stanie wysokim, wiec nacisniecie dowolnego klawisza daje zbocze
+    na kolumnie (key_edge) - nie trzeba odpytywac klawiatury w petli.
+    """
+    key = None
+    for row in ROWS:
+        GPIO.output(row, GPIO.LOW)
     for row_index, row in enumerate(ROWS):
         GPIO.output(row, GPIO.HIGH)
         for col_index, col in enumerate(COLS):
             if GPIO.input(col) == GPIO.HIGH:
-                GPIO.output(row, GPIO.LOW)
-                return KEYPAD[row_index][col_index]
+                key = KEYPAD[row_index][col_index]
+                break
         GPIO.output(row, GPIO.LOW)
-    return None
+        if key:
+            break
+    for row in ROWS:
+        GPIO.output(row, GPIO.HIGH)
+    if key:
+        if mask_keys and key in "0123456789":
+            tracing.record("key", **tracing.redact_key(key))
+        else:
+            tracing.record("key", key=key)
+    return key
+
+def key_edge(channel):
+    # Callback RPi.GPIO (z jego watku) - tylko budzimy zadanie klawiatury
+    runtime.call_soon(set_key_event)
+
+def set_key_event():
+    if key_event is not None:
+        key_event.set()
+
+async def next_key():
+    while True:
+        await key_event.wait()
+        key = read_keypad()
+        # Sam skan przelacza wiersze i daje zbocza - kasujemy je,
+        # zeby trzymany klawisz nie byl czytany wielokrotnie
+        await pause(KEY_SETTLE)
+        key_event.clear()
+        if key:
+            return key
+
+
+def locker_number_complete(entered, count):
+    """
+    Numer szafki jest kompletny, gdy dopisanie kolejnej cyfry
+    nie moze juz dac istniejacej szafki (np. "5" przy 4 szafkach,
+    "13" przy 128). Wtedy nie trzeba czekac na A.
+    """
+    return int(entered) * 10 > count
+
 
+async def keypad_task():
+    global key_event, mask_keys
+    key_event = asyncio.Event()
 
-def keypad_thread():
     current_menu = "main"
     action = None  # "open" lub "close"
     selected_locker = None
+    entered_locker = ""
     entered_code = ""
-    last_displayed_message = None
-
-    def update_lcd(message):
-        nonlocal last_displayed_message
-        if message != last_displayed_message:
-            lcd.clear()
-            lines = message.split("\n")[:2]
-            for i, line in enumerate(lines):
-                lcd.cursor_pos = (i, 0)
-                lcd.write_string(line.ljust(16))
-            last_displayed_message = message
 
     while True:
         if current_menu == "main":
-            update_lcd("Menu:\nA=Open B=Close")
+            lcd_show("Menu:\nA=Open B=Close")
 
         elif current_menu == "select_locker":
             if action == "open":
-                update_lcd("Otworz:\n1-4 #=back")
+                title = "Otworz"
             else:
-                update_lcd("Zamknij:\n1-4 #=back")
+                title = "Zamknij"
+            lcd_show(f"{title} 1-{len(LOCKERS)}:\n{entered_locker:<4} A=ok #=back")
 
         elif current_menu == "enter_code":
             # Ograniczamy np. do 4 cyfr
             disp_code = entered_code[:4]
-            update_lcd(f"L:{selected_locker+1}\nK:{disp_code}")
+            lcd_show(f"L:{selected_locker+1}\nK:{disp_code}")
 
-        key = read_keypad()
+        mask_keys = current_menu == "enter_code"
+        key = await next_key()
         if key:
             # ========== MAIN ==========
             if current_menu == "main":
                 if key == "A":
                     action = "open"
+                    entered_locker = ""
                     current_menu = "select_locker"
                 elif key == "B":
                     action = "close"
+                    entered_locker = ""
                     current_menu = "select_locker"
                 else:
                     # np. "#"
@@ -279,11 +556,27 @@ def keypad_thread():
 
             # ========== SELECT LOCKER ==========
             elif current_menu == "select_locker":
-                if key in "1234":
-                    sel = int(key)-1
+                confirm = False
+                if key in "0123456789":
+                    if len(entered_locker) < len(str(len(LOCKERS))):
+                        entered_locker += key
+                    confirm = locker_number_complete(entered_locker, len(LOCKERS))
+                elif key == "A":
+                    confirm = entered_locker != ""
+                elif key == "B":
+                    # backspace
+                    entered_locker = entered_locker[:-1]
+                elif key=="#":
+                    current_menu="main"
+                else:
+                    lcd_show("Zly klaw.\n0-9,A,B,#")
+                    await pause(1)
+
+                if confirm:
+                    sel = int(entered_locker)-1
                     if sel<0 or sel>=len(LOCKERS):
-                        update_lcd("Brak takiej\nszafki!")
-                        sleep(1)
+                        lcd_show("Brak takiej\nszafki!")
+                        await pause(1)
                         current_menu="main"
                     else:
                         selected_locker=sel
@@ -292,8 +585,8 @@ def keypad_thread():
                         if action=="open":
                             # Jesli juz unlocked?
                             if locker["status"]=="unlocked":
-                                update_lcd("Juz otwarta")
-                                sleep(1)
+                                lcd_show("Juz otwarta")
+                                await pause(1)
                                 current_menu="main"
                             else:
                                 entered_code=""
@@ -301,19 +594,14 @@ def keypad_thread():
                         else:
                             # close
                             if locker["status"]=="locked":
-                                update_lcd("Juz zamknieta")
-                                sleep(1)
+                                lcd_show("Juz zamknieta")
+                                await pause(1)
                                 current_menu="main"
                             else:
-                                lock_locker(selected_locker)
-                                update_lcd(f"Sz.{selected_locker+1}\nzamknieta")
-                                sleep(1)
+                                await actuate(selected_locker, "locked")
+                                lcd_show(f"Sz.{selected_locker+1}\nzamknieta")
+                                await pause(1)
                                 current_menu="main"
-                elif key=="#":
-                    current_menu="main"
-                else:
-                    update_lcd("Zly klaw.\n1-4,#=back")
-                    sleep(1)
 
             # ========== ENTER CODE (tylko open) ==========
             elif current_menu=="enter_code":
@@ -323,13 +611,13 @@ def keypad_thread():
                         entered_code += key
                 elif key=="A":
                     # potwierdz
-                    if check_code(entered_code, selected_locker):
-                        unlock_locker(selected_locker)
-                        update_lcd(f"Sz.{selected_locker+1}\notwarta!")
-                        sleep(1)
+                    if await runtime.run_blocking(check_code, entered_code, selected_locker):
+                        await actuate(selected_locker, "unlocked")
+                        lcd_show(f"Sz.{selected_locker+1}\notwarta!")
+                        await pause(1)
                     else:
-                        update_lcd("Zly kod!")
-                        sleep(1)
+                        lcd_show("Zly kod!")
+                        await pause(1)
                     current_menu="main"
                 elif key=="B":
                     # backspace
@@ -338,28 +626,87 @@ def keypad_thread():
                 elif key=="#":
                     current_menu="main"
                 else:
-                    update_lcd("Zly klaw.\n0-9,A,B,#")
-                    sleep(1)
+                    lcd_show("Zly klaw.\n0-9,A,B,#")
+                    await pause(1)
 
-        sleep(0.1)
 
 
 # ========== Endpointy Flask ==========
 
+def respond(payload, status=200, packed=None):
+    """
+    Odpowiedz w formacie z naglowka Accept: JSON (domyslnie), MessagePack
+    albo - jesli endpoint poda packed() - stala dlugosc rekordu (encoding.py).
+    """
+    fmt = request.accept_mimetypes.best_match(encoding.offers(packed is not None), default=encoding.JSON)
+    if fmt == encoding.PACKED_LOCKERS:
+        response = Response(packed(), status=status, mimetype=fmt)
+    elif fmt == encoding.MSGPACK:
+        response = Response(encoding.msgpack.packb(payload), status=status, mimetype=fmt)
+    else:
+        response = jsonify(payload)
+        response.status_code = status
+    response.vary.add("Accept")
+    return response
+
+@app.before_request
+def trace_start():
+    request.trace_t0 = perf_counter()
+
+@app.after_request
+def trace_request(response):
+    if tracing.recorder is not None:
+        tracing.record(
+            "http",
+            method=request.method,
+            path=request.full_path.rstrip("?"),
+            body=tracing.redact_fields(request.get_json(silent=True)) if request.is_json else None,
+            ctype=request.content_type,
+            auth=tracing.redact_auth(request.headers.get("Authorization")),
+            status=response.status_code,
+            resp=tracing.redact_fields(response.get_json(silent=True)) if request.path == "/login" else None,
+            ms=round((perf_counter() - request.trace_t0) * 1000, 2)
+        )
+    return response
+
+@app.before_request
+def wait_until_ready():
+    if not READY.is_set():
+        response = jsonify({"error": "Serwer uruchamia sie, sprobuj ponownie"})
+        response.status_code = 503
+        response.headers["Retry-After"] = "1"
+        return response
+
+@app.route('/runtime', methods=['GET'])
+def runtime_stats():
+    return {**runtime.stats(), "reconcile": RECONCILE_REPORT}, 200
+
+@app.route('/analytics', methods=['GET'])
+@require_admin
+def analytics_report():
+    return ANALYTICS.report(), 200
+
+@app.route('/analytics/lockers/<int:locker_id>', methods=['GET'])
+@require_admin
+def analytics_locker(locker_id):
+    if locker_id < 0 or locker_id >= len(LOCKERS):
+        return {"error": "Zly locker ID"}, 400
+    return ANALYTICS.locker_report(locker_id), 200
+
 @app.route('/register', methods=['POST'])
 def register():
     if not request.is_json:
         return {"error": "Expect JSON"}, 400
     data = request.get_json()
-    user = data.get("username")
-    pwd = data.get("password")
-    if not user or not pwd:
-        return {"error": "Missing user/pass"}, 400
+    # Ta sama normalizacja co przy imporcie (pusty kod = brak kodu)
+    new_user, error = provision.user_from(data if isinstance(data, dict) else {})
+    if error:
+        return {"error": error}, 400
 
     conn = sqlite3.connect(DB_NAME)
     c = conn.cursor()
     try:
-        c.execute("INSERT INTO users(username,password) VALUES(?,?)", (user, pwd))
+        c.execute("INSERT INTO users(username,password,code) VALUES(?,?,?)", new_user)
         conn.commit()
     except sqlite3.IntegrityError:
         conn.close()
@@ -367,6 +714,27 @@ def register():
     conn.close()
     return {"message": "OK"}, 200
 
+@app.route('/users/bulk', methods=['POST'])
+@require_admin
+def bulk_users():
+    """
+    Masowy import userow. Body: CSV (Content-Type text/csv) albo JSON-lines
+    (application/x-ndjson), mozna tez podac ?format=csv|jsonl.
+    Body jest czytane strumieniowo i zapisywane paczkami - patrz provision.py.
+    """
+    fmt = request.args.get("format") or provision.detect_format(request.content_type)
+    stream = io.TextIOWrapper(io.BufferedReader(request.stream), encoding="utf-8", newline="")
+    summary = provision.import_users(DB_NAME, provision.parse_rows(stream, fmt))
+    return jsonify(summary), 200
+
+@app.route('/users/export', methods=['GET'])
+@require_admin
+def export_users():
+    fmt = request.args.get("format", "jsonl")
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return Response(provision.export_users(DB_NAME, fmt), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename=users.{fmt}"})
+
 @app.route('/login', methods=['POST'])
 def login():
     if not request.is_json:
@@ -403,44 +771,47 @@ def get_lockers():
             "sensor_closed": lk["sensor_closed"],
             "owner_id": lk["owner_id"]
         })
-    return {"lockers": data}, 200
+    return respond({"lockers": data}, 200, packed=lambda: encoding.encode_lockers(data))
 
 @app.route('/lockers/<int:locker_id>/unlock', methods=['POST'])
 @require_auth
+@idempotent
 def unlock_endpoint(locker_id):
     user = request.current_user
     # sprawdzmy w tym miejscu, czy user -> owner, itp.
     locker = LOCKERS[locker_id]
     if locker["owner_id"] != user["id"]:
-        return {"error": "Brak dostepu"}, 403
+        return respond({"error": "Brak dostepu"}, 403)
 
     # tu też ewentualnie sprawdz sensor / code
     # jeżeli OK:
     unlock_locker(locker_id)
-    return {"success": True, "message": "Otwarta"}, 200
+    return respond({"success": True, "message": "Otwarta"}, 200)
 
 
 
 @app.route('/lockers/<int:locker_id>/lock', methods=['POST'])
+@idempotent
 def lock_endpoint(locker_id):
     """
     Teraz pozwalamy zamknac szafke nawet wtedy, gdy sensor_closed = False.
     Zmieniamy tylko logike w tym endpointcie.
     """
     if locker_id < 0 or locker_id >= len(LOCKERS):
-        return {"success": False, "message": "Zly locker ID"}, 400
+        return respond({"success": False, "message": "Zly locker ID"}, 400)
 
     locker = LOCKERS[locker_id]
 
     if locker["status"] == "locked":
-        return {"success": False, "message": "Szafka juz zamknieta"}, 400
+        return respond({"success": False, "message": "Szafka juz zamknieta"}, 400)
     else:
         # Jesli jest 'unlocked', lock_locker niezaleznie od sensor_closed
         lock_locker(locker_id)
-        return {"success": True, "message": "Zamknieto"}, 200
+        return respond({"success": True, "message": "Zamknieto"}, 200)
 
 @app.route('/lockers/<int:locker_id>/return', methods=['POST'])
 @require_auth
+@idempotent
 def return_locker(locker_id):
     """
     Zwraca (oddaje) szafke, jesli user jest jej wlascicielem (owner_id).
@@ -449,31 +820,39 @@ def return_locker(locker_id):
     """
     user = request.current_user
     if locker_id < 0 or locker_id >= len(LOCKERS):
-        return jsonify({"success": False, "message": "Zly locker ID"}), 400
+        return respond({"success": False, "message": "Zly locker ID"}, 400)
 
     locker = LOCKERS[locker_id]
 
     # Czy jest zajeta i wlasnosc bieżącego usera
     if not locker["occupied"] or locker["owner_id"] != user["id"]:
-        return jsonify({"success": False, "message": "Nie masz dostepu do tej szafki albo juz wolna"}), 403
+        return respond({"success": False, "message": "Nie masz dostepu do tej szafki albo juz wolna"}, 403)
 
     # Jesli jest locked => najpierw faktycznie otwieramy
     if locker["status"] == "locked":
         unlock_locker(locker_id)  # To faktycznie wykona set_angle(...) i ustawi status=unlocked, closed=False
 
     # Teraz logicznie zwalniamy szafke
-    locker["occupied"] = False
-    locker["owner_id"] = None
-    # Nie zmieniamy statusu "unlocked" recznie - bo 'unlock_locker' juz to zrobil
-    # (jesli faktycznie trzeba bylo)
-    update_locker_in_db(locker_id)
-
-    return jsonify({"success": True,
-                    "message": f"Szafka {locker_id+1} zwrocona i wolna"}), 200
+    with LOCKERS_LOCK:
+        # Rownolegly zwrot mogl juz oddac szafke komus z kolejki
+        if not locker["occupied"] or locker["owner_id"] != user["id"]:
+            return respond({"success": False, "message": "Nie masz dostepu do tej szafki albo juz wolna"}, 403)
+        locker["occupied"] = False
+        locker["owner_id"] = None
+        # Nie zmieniamy statusu "unlocked" recznie - bo 'unlock_locker' juz to zrobil
+        # (jesli faktycznie trzeba bylo)
+        update_locker_in_db(locker_id)
+        ANALYTICS.release(locker_id)
+        # Wolna szafka od razu trafia do pierwszego w kolejce oczekujacych
+        grant_to_waitlist(locker_id)
+
+    return respond({"success": True,
+                    "message": f"Szafka {locker_id+1} zwrocona i wolna"}, 200)
 
 
 @app.route('/lockers/deposit', methods=['POST'])
 @require_auth
+@idempotent
 def deposit():
     """
     Rezerwacja (zajecie) konkretnej szafki przez zalogowanego usera.
@@ -483,67 +862,235 @@ def deposit():
     """
     user = request.current_user
     if not request.is_json:
-        return jsonify({"success": False, "message": "Expect JSON"}), 400
+        return respond({"success": False, "message": "Expect JSON"}, 400)
 
     data = request.get_json()
     locker_id = data.get("locker_id")
     if locker_id is None:
-        return jsonify({"success": False, "message": "No locker_id"}), 400
+        return respond({"success": False, "message": "No locker_id"}, 400)
 
     if locker_id < 0 or locker_id >= len(LOCKERS):
-        return jsonify({"success": False, "message": "Invalid locker ID"}), 400
-
-    locker = LOCKERS[locker_id]
-    if locker["occupied"]:
-        return jsonify({"success": False, "message": "Locker already occupied"}), 400
+        return respond({"success": False, "message": "Invalid locker ID"}, 400)
 
-    locker["occupied"] = True
-    locker["owner_id"] = user["id"]
-    locker["status"] = "unlocked"
-    locker["closed"] = False
-    update_locker_in_db(locker_id)
+    with LOCKERS_LOCK:
+        if LOCKERS[locker_id]["occupied"]:
+            return respond({"success": False, "message": "Locker already occupied"}, 400)
+        reserve_locker(locker_id, user["id"])
 
-    return jsonify({
+    return respond({
         "success": True,
         "message": f"Locker {locker_id+1} reserved & open for user {user['username']}",
         "locker_id": locker_id,
         "owner_id": user["id"]
-    }), 200
+    }, 200)
 
 
-# ========== Główna pętla ==========
+def reserve_locker(locker_id, user_id):
+    """Zajmuje szafke dla usera. Wolac pod LOCKERS_LOCK."""
+    locker = LOCKERS[locker_id]
+    previous = dict(locker)
+    locker["occupied"] = True
+    locker["owner_id"] = user_id
+    locker["status"] = "unlocked"
+    locker["closed"] = False
+    try:
+        update_locker_in_db(locker_id)
+    except Exception:
+        # Bez zapisu w bazie szafka zostaje wolna (tez w pamieci)
+        locker.update(previous)
+        raise
+    ANALYTICS.deposit(locker_id)
+    return locker_id
+
+def grant_to_waitlist(locker_id):
+    """Wolna szafka dla pierwszego w kolejce. Wolac pod LOCKERS_LOCK."""
+    try:
+        WAITLIST.grant(lambda user_id: reserve_locker(locker_id, user_id))
+    except Exception as e:
+        # Oczekujacy zostaje pierwszy, szafka wolna - przydzial przy
+        # nastepnym zwrocie albo dopisaniu do kolejki
+        print(f"Przydzial szafki {locker_id+1} z kolejki nie powiodl sie: {e!r}")
 
-if __name__ == "__main__":
-    init_db()
+
+# ========== Kolejka oczekujacych ==========
+
+WAITLIST_SWEEP = 5   # co ile sekund zwalniamy nieodebrane przydzialy
+
+def release_grant(entry):
+    """
+    Zwalnia szafke z nieodebranego przydzialu i oddaje ja nastepnemu
+    w kolejce. Wolac pod LOCKERS_LOCK.
+    """
+    locker_id = entry["locker_id"]
+    locker = LOCKERS[locker_id]
+    if not locker["occupied"] or locker["owner_id"] != entry["user_id"]:
+        return
+    locker["occupied"] = False
+    locker["owner_id"] = None
+    try:
+        update_locker_in_db(locker_id)
+    except Exception as e:
+        locker["occupied"] = True
+        locker["owner_id"] = entry["user_id"]
+        print(f"Zwolnienie szafki {locker_id+1} z przydzialu nie powiodlo sie: {e!r}")
+        return
+    ANALYTICS.release(locker_id)
+    grant_to_waitlist(locker_id)
+
+def release_expired_grants():
+    with LOCKERS_LOCK:
+        for entry in WAITLIST.expired_grants():
+            release_grant(entry)
+
+async def waitlist_task():
+    while True:
+        await pause(WAITLIST_SWEEP)
+        await runtime.run_blocking(release_expired_grants)
+
+def waitlist_response(entry):
+    locker_id = entry["locker_id"]
+    if locker_id is not None:
+        # Od tej chwili szafka jest usera - nie wygasa razem z biletem
+        if not WAITLIST.claim(entry):
+            return respond({"success": False, "message": "Przydzial wygasl"}, 404)
+        return respond({
+            "success": True,
+            "ticket": entry["ticket"],
+            "locker_id": locker_id,
+            "message": f"Szafka {locker_id+1} przydzielona"
+        }, 200)
+    position = WAITLIST.position(entry)
+    if position is None:
+        return respond({"success": False, "message": "Bilet wygasl albo anulowany"}, 404)
+    response = respond({
+        "success": False,
+        "ticket": entry["ticket"],
+        "position": position,
+        "message": "Czekasz na wolna szafke"
+    }, 202)
+    response.headers["Retry-After"] = str(WAITLIST_POLL_INTERVAL)
+    return response
+
+@app.route('/lockers/waitlist', methods=['POST'])
+@require_auth
+def waitlist_join():
+    """
+    Zajmuje wolna szafke, a jesli wszystkie sa zajete - dopisuje usera do
+    kolejki. ?wait=N trzyma zapytanie do N sekund (max waitlist.MAX_WAIT),
+    az zwrot szafki przydzieli ja temu userowi.
+    """
+    user = request.current_user
+    wait = request.args.get("wait", 0, type=float)
+    release_expired_grants()
+    with LOCKERS_LOCK:
+        free = next((i for i, lk in enumerate(LOCKERS) if not lk["occupied"]), None)
+        if free is not None and WAITLIST.waiting():
+            # Wolna szafka przy niepustej kolejce = nieudany przydzial przy zwrocie
+            grant_to_waitlist(free)
+            free = next((i for i, lk in enumerate(LOCKERS) if not lk["occupied"]), None)
+        # Wolna szafka tylko wtedy, gdy nikt nie czeka - inaczej kolejnosc FIFO
+        if not WAITLIST.waiting():
+            if free is not None:
+                reserve_locker(free, user["id"])
+                return respond({
+                    "success": True,
+                    "ticket": None,
+                    "locker_id": free,
+                    "message": f"Szafka {free+1} przydzielona"
+                }, 200)
+        entry = WAITLIST.join(user["id"])
+    if entry is None:
+        return respond({"success": False, "message": "Kolejka pelna"}, 503)
+    if wait > 0:
+        WAITLIST.wait(entry, wait)
+    return waitlist_response(entry)
+
+@app.route('/lockers/waitlist/<ticket>', methods=['GET'])
+@require_auth
+def waitlist_status(ticket):
+    """Stan biletu; ?wait=N czeka (long-poll) na przydzial szafki."""
+    entry = WAITLIST.get(ticket)
+    if entry is None or entry["user_id"] != request.current_user["id"]:
+        return respond({"success": False, "message": "Bilet wygasl albo anulowany"}, 404)
+    wait = request.args.get("wait", 0, type=float)
+    if wait > 0:
+        WAITLIST.wait(entry, wait)
+    return waitlist_response(entry)
+
+@app.route('/lockers/waitlist/<ticket>', methods=['DELETE'])
+@require_auth
+def waitlist_leave(ticket):
+    entry = WAITLIST.get(ticket)
+    if entry is None or entry["user_id"] != request.current_user["id"]:
+        return respond({"success": False, "message": "Bilet wygasl albo anulowany"}, 404)
+    WAITLIST.leave(ticket)
+    if entry["locker_id"] is not None and not entry["claimed"]:
+        # Rezygnacja z przydzialu, ktorego user jeszcze nie odebral
+        with LOCKERS_LOCK:
+            release_grant(entry)
+    return respond({"success": True, "message": "Usunieto z kolejki"}, 200)
+
+
+# ========== Start sprzetu ==========
+
+def start_hardware():
+    """
+    Laczy sie ze sprzetem (albo z simulator.py przy odtwarzaniu sladu)
+    i uruchamia petle sprzetu z zadaniami LCD, czujnikow i klawiatury.
+    """
+    global pi, lcd
     pi = pigpio.pi()
     GPIO.setmode(GPIO.BCM)
     GPIO.setwarnings(False)
 
-    for i, lk in enumerate(LOCKERS):
-        GPIO.setup(lk["sensor_pin"], GPIO.IN, pull_up_down=GPIO.PUD_UP)
+    attach_hardware()
 
+    lcd_cfg = TOPOLOGY["lcd"]
     lcd = CharLCD(
-        i2c_expander='PCF8574',
-        address=0x3f,
-        port=1,
-        cols=16,
-        rows=2
+        i2c_expander=lcd_cfg["i2c_expander"],
+        address=int(str(lcd_cfg["address"]), 0),
+        port=lcd_cfg["port"],
+        cols=lcd_cfg["cols"],
+        rows=lcd_cfg["rows"]
     )
 
+    # Wiersze w spoczynku wysoko - nacisniecie klawisza daje zbocze na kolumnie
     for r in ROWS:
         GPIO.setup(r, GPIO.OUT)
-        GPIO.output(r, GPIO.LOW)
+        GPIO.output(r, GPIO.HIGH)
     for c in COLS:
         GPIO.setup(c, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+        GPIO.add_event_detect(c, GPIO.RISING, callback=key_edge, bouncetime=50)
+
+    # Najpierw uzgodnienie stanu, dopiero potem czujniki, klawiatura i API
+    runtime.supervise("lcd", lcd_task)
+    runtime.start()
+    future = asyncio.run_coroutine_threadsafe(reconcile_bounded(), runtime.loop)
+    try:
+        future.result((RECONCILE["timeout"] + 2 * RECONCILE_GRACE) * TIME_SCALE)
+    except Exception as e:
+        # Np. petla zablokowana na odczycie I2C - anulujemy tez stad, zeby
+        # uzgadnianie nie ruszalo serwami obok klawiatury i API
+        future.cancel()
+        RECONCILE_REPORT["error"] = repr(e)
+        print(f"Uzgadnianie nie powiodlo sie: {e!r}")
+    runtime.supervise("sensors", sensor_task)
+    runtime.supervise("keypad", keypad_task)
+    runtime.supervise("waitlist", waitlist_task)
+    READY.set()
 
-    t_sens = threading.Thread(target=sensor_thread, daemon=True)
-    t_sens.start()
 
-    t_key = threading.Thread(target=keypad_thread, daemon=True)
-    t_key.start()
+# ========== Główna pętla ==========
+
+if __name__ == "__main__":
+    init_db()
+    # Slad startuje przed watkami, zeby zlapac pierwszy odczyt czujnikow
+    tracing.start_from_env(DB_NAME, TOPOLOGY, len(LOCKERS))
+    start_hardware()
 
     try:
         app.run(host="0.0.0.0", port=5000)
     except KeyboardInterrupt:
+        runtime.stop()
         GPIO.cleanup()
         pi.stop()
\ No newline at end of file
@@ -0,0 +1,223 @@
+"""
+Symulowany sprzet: zastepuje moduly pigpio, RPi.GPIO i RPLCD.i2c,
+zeby server.py dzialal bez Raspberry Pi (np. w replay.py).
+
+    hw = simulator.install()   # przed "import server"
+    import server
+
+Symulacja obejmuje piny GPIO (read_bank_1), serwa, rejestry urzadzen I2C
+(PCA9685, MCP23017), LCD i matryce klawiatury 4x4 - nacisniety klawisz
+jest widoczny dla read_keypad() dokladnie raz i daje zbocze na kolumnie
+(GPIO.add_event_detect), tak jak prawdziwa klawiatura.
+"""
+import sys
+import threading
+import types
+from collections import deque
+from time import monotonic
+
+HIGH = 1
+LOW = 0
+MCP23017_GPIOA = 0x12
+
+
+class SimHardware:
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.levels = 0            # bity GPIO 0-31
+        self.outputs = {}          # pin -> poziom ustawiony przez GPIO.output
+        self.servos = {}           # pin -> szerokosc impulsu
+        self.i2c = {}              # handle -> (bus, address, rejestry)
+        self.devices = {}          # (bus, address) -> rejestry, wspolne dla uchwytow
+        self.lcd_text = ""
+        self.keypad = None         # (rows, cols, keys)
+        self.keys = deque()
+        self.pressed = None        # (row_pin, col_pin) aktualnie nacisniety
+        self.edge_callbacks = {}   # pin -> callback z GPIO.add_event_detect
+
+    # ----- klawiatura -----
+
+    def attach_keypad(self, rows, cols, keys):
+        self.keypad = (rows, cols, keys)
+
+    def press(self, key):
+        with self.lock:
+            self.keys.append(key)
+        self._edge()
+
+    def wait_keys(self, timeout):
+        """Czeka, az wszystkie nacisniete klawisze zostana odczytane."""
+        deadline = monotonic() + timeout
+        while True:
+            with self.lock:
+                if self.lock.wait_for(lambda: not self.keys and self.pressed is None, 0.01):
+                    return True
+            if monotonic() > deadline:
+                return False
+            # Klawisz wciaz "trzymany" - ponawiamy zbocze, gdyby serwer
+            # skasowal poprzednie razem ze zboczami wlasnego skanu
+            self._edge()
+
+    def _key_pins(self, key):
+        rows, cols, keys = self.keypad
+        for r, row in enumerate(keys):
+            if key in row:
+                return (rows[r], cols[row.index(key)])
+        return None
+
+    def _current_key(self):
+        if self.pressed is None and self.keys:
+            self.pressed = self._key_pins(self.keys.popleft())
+        return self.pressed
+
+    def _edge(self):
+        with self.lock:
+            pins = self.pressed or (self.keys and self._key_pins(self.keys[0]))
+        callback = self.edge_callbacks.get(pins[1]) if pins else None
+        if callback:
+            callback(pins[1])
+
+    def read_pin(self, pin):
+        with self.lock:
+            if self.keypad and pin in self.keypad[1]:
+                pressed = self._current_key()
+                if pressed and pressed[1] == pin and self.outputs.get(pressed[0]) == HIGH:
+                    self.pressed = None   # klawisz "puszczony" po odczycie
+                    self.lock.notify_all()
+                    return HIGH
+                return LOW
+            return (self.levels >> pin) & 1
+
+    # ----- czujniki -----
+
+    def set_sensor(self, sensor, closed):
+        """sensor = (port, maska) z topology.build_hardware."""
+        port, mask = sensor
+        with self.lock:
+            if hasattr(port, "handle"):
+                regs = self.i2c[port.handle][2]
+                value = regs[port.GPIOA] | (regs[port.GPIOA + 1] << 8)
+                value = value | mask if closed else value & ~mask
+                regs[port.GPIOA] = value & 0xFF
+                regs[port.GPIOA + 1] = value >> 8
+            else:
+                self.levels = self.levels | mask if closed else self.levels & ~mask
+
+    def set_slot(self, slot, closed):
+        """
+        Jak set_sensor, ale po opisie z topology.locker_slots - dziala
+        przed start_hardware, np. zeby ustawic drzwi przed uzgadnianiem.
+        """
+        driver, bus, address, pin = slot
+        with self.lock:
+            if driver == "mcp23017":
+                regs = self.devices.setdefault((bus, address), bytearray(256))
+                reg = MCP23017_GPIOA + pin // 8
+                bit = 1 << (pin % 8)
+                regs[reg] = regs[reg] | bit if closed else regs[reg] & ~bit
+            else:
+                self.levels = self.levels | (1 << pin) if closed else self.levels & ~(1 << pin)
+
+
+class SimPi:
+    """Odpowiednik pigpio.pi()."""
+    connected = True
+
+    def __init__(self, hw):
+        self.hw = hw
+
+    def set_mode(self, pin, mode):
+        pass
+
+    def set_pull_up_down(self, pin, pud):
+        pass
+
+    def read(self, pin):
+        return self.hw.read_pin(pin)
+
+    def read_bank_1(self):
+        return self.hw.levels
+
+    def set_servo_pulsewidth(self, pin, pulse):
+        self.hw.servos[pin] = pulse
+
+    def get_servo_pulsewidth(self, pin):
+        return self.hw.servos.get(pin, 0)
+
+    def i2c_open(self, bus, address):
+        handle = len(self.hw.i2c)
+        regs = self.hw.devices.setdefault((bus, address), bytearray(256))
+        self.hw.i2c[handle] = (bus, address, regs)
+        return handle
+
+    def i2c_close(self, handle):
+        pass
+
+    def i2c_write_byte_data(self, handle, reg, value):
+        self.hw.i2c[handle][2][reg] = value
+
+    def i2c_write_i2c_block_data(self, handle, reg, data):
+        self.hw.i2c[handle][2][reg:reg + len(data)] = bytes(data)
+
+    def i2c_read_byte_data(self, handle, reg):
+        return self.hw.i2c[handle][2][reg]
+
+    def i2c_read_i2c_block_data(self, handle, reg, count):
+        return count, bytearray(self.hw.i2c[handle][2][reg:reg + count])
+
+    def stop(self):
+        pass
+
+
+class SimLCD:
+    """Odpowiednik RPLCD.i2c.CharLCD."""
+
+    def __init__(self, hw, **kwargs):
+        self.hw = hw
+        self.cursor_pos = (0, 0)
+
+    def clear(self):
+        self.hw.lcd_text = ""
+
+    def write_string(self, text):
+        self.hw.lcd_text += text
+
+
+def install(hw=None):
+    """Rejestruje symulowane moduly w sys.modules i zwraca stan sprzetu."""
+    hw = hw or SimHardware()
+
+    pigpio = types.ModuleType("pigpio")
+    pigpio.INPUT, pigpio.OUTPUT = 0, 1
+    pigpio.PUD_OFF, pigpio.PUD_DOWN, pigpio.PUD_UP = 0, 1, 2
+    pigpio.pi = lambda *args: SimPi(hw)
+
+    gpio = types.ModuleType("RPi.GPIO")
+    gpio.BCM, gpio.IN, gpio.OUT = 11, 1, 0
+    gpio.HIGH, gpio.LOW = HIGH, LOW
+    gpio.RISING, gpio.FALLING, gpio.BOTH = 31, 32, 33
+    gpio.PUD_UP, gpio.PUD_DOWN = 22, 21
+    gpio.setmode = lambda mode: None
+    gpio.setwarnings = lambda flag: None
+    gpio.setup = lambda pin, mode, pull_up_down=None: None
+    gpio.output = lambda pin, level: hw.outputs.__setitem__(pin, level)
+    gpio.input = hw.read_pin
+    gpio.add_event_detect = lambda pin, edge, callback=None, bouncetime=None: \
+        hw.edge_callbacks.__setitem__(pin, callback)
+    gpio.cleanup = lambda: None
+    rpi = types.ModuleType("RPi")
+    rpi.GPIO = gpio
+
+    rplcd_i2c = types.ModuleType("RPLCD.i2c")
+    rplcd_i2c.CharLCD = lambda **kwargs: SimLCD(hw, **kwargs)
+    rplcd = types.ModuleType("RPLCD")
+    rplcd.i2c = rplcd_i2c
+
+    sys.modules.update({
+        "pigpio": pigpio,
+        "RPi": rpi,
+        "RPi.GPIO": gpio,
+        "RPLCD": rplcd,
+        "RPLCD.i2c": rplcd_i2c,
+    })
+    return hw
@@ -0,0 +1,270 @@
+"""
+Topologia sprzetu szafek: klawiatura, LCD, serwa i czujniki drzwi.
+
+Konfiguracja jest czytana z pliku topology.json (sciezke mozna zmienic
+zmienna SUREBOX_TOPOLOGY). Bez pliku uzywamy DEFAULT_TOPOLOGY, czyli
+4 szafek podpietych bezposrednio do GPIO Raspberry Pi.
+
+Szafki opisuje lista "banks" - kazdy bank to kolejne szafki z tym samym
+sterownikiem serw i czujnikow:
+
+  serwa:    {"driver": "gpio", "pins": [7, 21]}
+            {"driver": "pca9685", "address": "0x40", "channel": 0}
+  czujniki: {"driver": "gpio", "pins": [1, 20]}
+            {"driver": "mcp23017", "address": "0x20", "pin": 0}
+
+Dla ekspanderow I2C bank podaje "count", a kolejne szafki zajmuja kolejne
+kanaly/piny - po 16 na plytke, potem nastepny adres (0x40, 0x41, ...).
+Dzieki temu jeden wpis opisuje setki drzwi.
+"""
+import json
+import os
+from time import sleep
+
+import pigpio
+
+TOPOLOGY_FILE = os.environ.get("SUREBOX_TOPOLOGY", "topology.json")
+
+DEFAULT_TOPOLOGY = {
+    "i2c_bus": 1,
+    "keypad": {
+        "rows": [17, 27, 22, 23],
+        "cols": [5, 6, 13, 19],
+        "keys": [
+            ["1", "2", "3", "A"],
+            ["4", "5", "6", "B"],
+            ["7", "8", "9", "C"],
+            ["*", "0", "#", "D"]
+        ]
+    },
+    "lcd": {
+        "i2c_expander": "PCF8574",
+        "address": "0x3f",
+        "port": 1,
+        "cols": 16,
+        "rows": 2
+    },
+    "banks": [
+        {
+            "servo": {"driver": "gpio", "pins": [7, 21, 15, 26]},
+            "sensor": {"driver": "gpio", "pins": [1, 20, 14, 12]}
+        }
+    ],
+    # Uzgadnianie stanu po starcie: ile serw rusza naraz (prad zasilacza),
+    # ile czekamy na paczke, limit calej fazy i czy ruszac wszystkie serwa
+    # (False = tylko szafki niezgodne z czujnikami)
+    "reconcile": {
+        "servo_batch": 4,
+        "settle": 0.5,
+        "timeout": 20,
+        "drive_all": True
+    }
+}
+
+CHANNELS_PER_BOARD = 16
+
+# Adresy, ktore plytka moze miec (zworki adresowe); 0x70 to adres
+# all-call PCA9685 - slysza go wszystkie plytki naraz
+ADDRESS_RANGES = {
+    "pca9685": (0x40, 0x7F, {0x70}),
+    "mcp23017": (0x20, 0x27, set()),
+}
+
+
+def _int(value):
+    """Adresy w JSON moga byc zapisane jako "0x40" albo 64."""
+    if isinstance(value, str):
+        return int(value, 0)
+    return int(value)
+
+
+def load_topology(path=TOPOLOGY_FILE):
+    if not os.path.exists(path):
+        return DEFAULT_TOPOLOGY
+    with open(path) as f:
+        topology = json.load(f)
+    for key, value in DEFAULT_TOPOLOGY.items():
+        topology.setdefault(key, value)
+    return topology
+
+
+def _bank_size(bank):
+    if "count" in bank:
+        return int(bank["count"])
+    for part in ("servo", "sensor"):
+        if "pins" in bank[part]:
+            return len(bank[part]["pins"])
+    raise ValueError("Bank bez 'count' i bez listy 'pins'")
+
+
+def _bank_slots(spec, count, bus):
+    """
+    Zwraca liste (driver, bus, address, pin) dla kolejnych szafek banku.
+    Dla "gpio" address jest None, a pin to numer BCM.
+    """
+    driver = spec["driver"]
+    if driver == "gpio":
+        pins = spec["pins"]
+        if len(pins) < count:
+            raise ValueError(f"Za malo pinow GPIO: {len(pins)} < {count}")
+        return [("gpio", None, None, pin) for pin in pins[:count]]
+    if driver in ("pca9685", "mcp23017"):
+        bus = spec.get("bus", bus)
+        address = _int(spec["address"])
+        first = int(spec.get("channel", spec.get("pin", 0)))
+        low, high, reserved = ADDRESS_RANGES[driver]
+        slots = []
+        for n in range(first, first + count):
+            board = address + n // CHANNELS_PER_BOARD
+            if not low <= board <= high or board in reserved:
+                raise ValueError(
+                    f"{driver}: adres 0x{board:02x} poza zakresem 0x{low:02x}-0x{high:02x}"
+                    + (f" (bez {', '.join(hex(a) for a in sorted(reserved))})" if reserved else "")
+                    + f" - bank {count} szafek od 0x{address:02x} nie miesci sie na szynie {bus};"
+                    " podziel go na banki na innych szynach (\"bus\") albo uzyj multipleksera I2C")
+            slots.append((driver, bus, board, n % CHANNELS_PER_BOARD))
+        return slots
+    raise ValueError(f"Nieznany sterownik: {driver}")
+
+
+def locker_slots(topology):
+    """
+    Lista (servo_slot, sensor_slot) dla wszystkich szafek, w kolejnosci id.
+    Nie dotyka sprzetu - uzywane tez przy inicjalizacji bazy.
+    """
+    bus = topology.get("i2c_bus", 1)
+    slots = []
+    for bank in topology["banks"]:
+        count = _bank_size(bank)
+        servos = _bank_slots(bank["servo"], count, bus)
+        sensors = _bank_slots(bank["sensor"], count, bus)
+        slots.extend(zip(servos, sensors))
+    return slots
+
+
+# ========== Sterowniki serw ==========
+
+class GpioServo:
+    def __init__(self, pi, pin):
+        self.pi = pi
+        self.pin = pin
+
+    def set_pulsewidth(self, pulse):
+        self.pi.set_servo_pulsewidth(self.pin, pulse)
+
+
+class Pca9685:
+    """Plytka PCA9685: 16 kanalow PWM, 50 Hz dla serw."""
+    MODE1 = 0x00
+    PRESCALE = 0xFE
+    LED0_ON_L = 0x06
+    OSC_HZ = 25_000_000
+    FREQ_HZ = 50
+
+    def __init__(self, pi, bus, address):
+        self.pi = pi
+        self.handle = pi.i2c_open(bus, address)
+        prescale = round(self.OSC_HZ / (4096 * self.FREQ_HZ)) - 1
+        pi.i2c_write_byte_data(self.handle, self.MODE1, 0x10)   # sleep
+        pi.i2c_write_byte_data(self.handle, self.PRESCALE, prescale)
+        pi.i2c_write_byte_data(self.handle, self.MODE1, 0x20)   # auto-increment
+        sleep(0.0005)
+        pi.i2c_write_byte_data(self.handle, self.MODE1, 0xA0)   # restart
+
+    def set_pulsewidth(self, channel, pulse):
+        ticks = int(pulse * 4096 * self.FREQ_HZ / 1_000_000)
+        reg = self.LED0_ON_L + 4 * channel
+        self.pi.i2c_write_i2c_block_data(self.handle, reg, [0, 0, ticks & 0xFF, ticks >> 8])
+
+
+class Pca9685Servo:
+    def __init__(self, board, channel):
+        self.board = board
+        self.channel = channel
+
+    def set_pulsewidth(self, pulse):
+        self.board.set_pulsewidth(self.channel, pulse)
+
+
+# ========== Porty czujnikow (odczyt hurtowy) ==========
+
+class GpioPort:
+    """Wszystkie piny GPIO 0-31 czytane jednym wywolaniem read_bank_1."""
+
+    def __init__(self, pi):
+        self.pi = pi
+
+    def setup(self, pin):
+        self.pi.set_mode(pin, pigpio.INPUT)
+        self.pi.set_pull_up_down(pin, pigpio.PUD_UP)
+
+    def read(self):
+        return self.pi.read_bank_1()
+
+
+class Mcp23017:
+    """Ekspander MCP23017: 16 wejsc, porty A i B czytane jednym transferem I2C."""
+    IODIRA = 0x00
+    GPPUA = 0x0C
+    GPIOA = 0x12
+
+    def __init__(self, pi, bus, address):
+        self.pi = pi
+        self.handle = pi.i2c_open(bus, address)
+        # Wszystkie piny jako wejscia z pull-up (rejestry A i B po kolei)
+        pi.i2c_write_i2c_block_data(self.handle, self.IODIRA, [0xFF, 0xFF])
+        pi.i2c_write_i2c_block_data(self.handle, self.GPPUA, [0xFF, 0xFF])
+
+    def setup(self, pin):
+        pass
+
+    def read(self):
+        count, data = self.pi.i2c_read_i2c_block_data(self.handle, self.GPIOA, 2)
+        if count != 2:
+            raise IOError(f"MCP23017: odczyt I2C nieudany ({count})")
+        return data[0] | (data[1] << 8)
+
+
+def build_hardware(pi, topology):
+    """
+    Tworzy obiekty sprzetu dla kazdej szafki: (servo, (port, maska)).
+    Plytki I2C sa wspoldzielone przez szafki na tym samym adresie.
+    """
+    boards = {}
+    gpio_port = GpioPort(pi)
+
+    def board(cls, bus, address):
+        key = (cls, bus, address)
+        if key not in boards:
+            boards[key] = cls(pi, bus, address)
+        return boards[key]
+
+    hardware = []
+    for servo_slot, sensor_slot in locker_slots(topology):
+        driver, bus, address, pin = servo_slot
+        if driver == "gpio":
+            servo = GpioServo(pi, pin)
+        else:
+            servo = Pca9685Servo(board(Pca9685, bus, address), pin)
+
+        driver, bus, address, pin = sensor_slot
+        port = gpio_port if driver == "gpio" else board(Mcp23017, bus, address)
+        port.setup(pin)
+        hardware.append((servo, (port, 1 << pin)))
+    return hardware
+
+
+def read_sensors(sensors):
+    """
+    Czyta stan drzwi dla listy (port, maska). Kazdy port jest czytany
+    tylko raz, niezaleznie od liczby szafek na nim.
+    True = drzwi zamkniete (stan wysoki).
+    """
+    ports = {}
+    states = []
+    for port, mask in sensors:
+        bits = ports.get(port)
+        if bits is None:
+            bits = ports[port] = port.read()
+        states.append(bool(bits & mask))
+    return states
@@ -0,0 +1,144 @@
+"""
+Nagrywanie sladu zdarzen (HTTP, klawiatura, czujniki, stan szafek).
+
+Wlaczane zmienna SUREBOX_TRACE=sciezka. Slad to plik JSON-lines
+kompresowany gzip, jedna linia na zdarzenie:
+
+  {"t": 1234.5, "k": "http", ...}
+
+gdzie "t" to milisekundy od startu nagrywania, a "k" to rodzaj:
+  start  - poczatek sladu (topologia, liczba szafek)
+  http   - zapytanie do API: metoda, sciezka, body JSON, token, status, czas
+           (odpowiedz tylko dla /login - replay potrzebuje z niej tokenu)
+  key    - klawisz zwrocony przez read_keypad
+  sensor - zmiana stanu czujnika drzwi
+  locker - stan szafki po zapisie do bazy
+
+Obok sladu zapisywana jest kopia bazy (<slad>.db) z chwili startu,
+zeby replay.py mogl odtworzyc wszystko od tego samego stanu.
+
+Hasla, kody i tokeny nie trafiaja do sladu jawnie - zamiast nich jest
+HMAC z losowym kluczem nagrania (redact). Klucz lezy tylko w kopii bazy,
+ktora i tak zawiera te dane; replay.py odzyskuje z niej wartosci userow
+istniejacych przed nagraniem. Body inne niz JSON (np. /users/bulk) nie
+sa zapisywane. Cyfry kodu wpisywane na klawiaturze zapisujemy jako HMAC
+z losowym "n" (redact_key) - replay.py odtwarza cyfre, sprawdzajac 0-9.
+"""
+import atexit
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import threading
+from time import monotonic
+
+FLUSH_INTERVAL = 1.0  # sekundy
+SECRET_FIELDS = ("password", "code", "token")
+REDACTED = "h:"       # przedrostek zamaskowanej wartosci
+
+recorder = None
+
+
+class TraceRecorder:
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.file = gzip.open(path, "wt", encoding="utf-8")
+        self.lock = threading.Lock()
+        self.t0 = monotonic()
+        self.last_flush = self.t0
+
+    def record(self, kind, **fields):
+        now = monotonic()
+        event = {"t": round((now - self.t0) * 1000, 1), "k": kind}
+        event.update(fields)
+        line = json.dumps(event, separators=(",", ":"))
+        with self.lock:
+            self.file.write(line + "\n")
+            # Flush co jakis czas, a nie po kazdym zdarzeniu - gzip
+            # kompresuje wtedy duzo lepiej, a po awarii tracimy max ~1 s
+            if now - self.last_flush >= FLUSH_INTERVAL:
+                self.file.flush()
+                self.last_flush = now
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def snapshot_path(trace_path):
+    return trace_path + ".db"
+
+
+def start(path, db_name, topology, lockers_count):
+    global recorder
+    key = os.urandom(16)
+    src = sqlite3.connect(db_name)
+    dst = sqlite3.connect(snapshot_path(path))
+    src.backup(dst)
+    with dst:
+        dst.execute("CREATE TABLE trace_key (key BLOB)")
+        dst.execute("INSERT INTO trace_key VALUES (?)", (key,))
+    dst.close()
+    src.close()
+
+    recorder = TraceRecorder(path, key)
+    atexit.register(recorder.close)
+    recorder.record("start", topology=topology, lockers=lockers_count)
+
+
+def start_from_env(db_name, topology, lockers_count):
+    path = os.environ.get("SUREBOX_TRACE")
+    if path:
+        start(path, db_name, topology, lockers_count)
+
+
+def record(kind, **fields):
+    if recorder is not None:
+        recorder.record(kind, **fields)
+
+
+def redact(value, key=None):
+    if value is None:
+        return None
+    key = key if key is not None else recorder.key
+    return REDACTED + hmac.new(key, str(value).encode(), hashlib.sha256).hexdigest()[:24]
+
+
+def redact_fields(data):
+    """Kopia body/odpowiedzi JSON z zamaskowanymi polami SECRET_FIELDS."""
+    if not isinstance(data, dict):
+        return data
+    return {k: redact(v) if k in SECRET_FIELDS else v for k, v in data.items()}
+
+
+def redact_key(key):
+    """Pola zdarzenia "key" dla cyfry kodu - kazde nacisniecie z innym n."""
+    nonce = os.urandom(4).hex()
+    return {"key": redact(nonce + key), "n": nonce}
+
+
+def unredact_key(event, key):
+    """Cyfra z zdarzenia zapisanego przez redact_key (klucz z kopii bazy)."""
+    return next(d for d in "0123456789" if redact(event["n"] + d, key) == event["key"])
+
+
+def redact_auth(header):
+    if not header:
+        return None
+    return redact(header.replace("Bearer ", ""))
+
+
+def snapshot_key(trace_path):
+    conn = sqlite3.connect(snapshot_path(trace_path))
+    try:
+        return conn.execute("SELECT key FROM trace_key").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def load(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
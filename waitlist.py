@@ -0,0 +1,207 @@
+"""
+Kolejka oczekujacych na wolna szafke (FIFO).
+
+Gdy wszystkie szafki sa zajete, user dostaje bilet zamiast odpytywac
+/lockers w kolko. Zwrot szafki (return) oddaje ja od razu pierwszemu
+oczekujacemu - server.py robi to pod tym samym lockiem co deposit/return.
+
+Oczekujacy to wpis w slowniku z numerem w kolejce - miejsce liczymy
+z licznikow, bez przegladania kolejki. Trzymane zapytanie (long-poll)
+zajmuje jednak watek serwera, dlatego naraz trzymamy co najwyzej
+MAX_HELD zapytan; kolejne dostaja bilet od razu. Do przydzialu szafki
+pytanie nie jest potrzebne (dzieje sie przy zwrocie), wiec klient pyta
+tylko co POLL_INTERVAL, zeby bilet nie wygasl.
+
+Bilet, o ktory nikt nie pyta dluzej niz TTL sekund, wygasa i traci
+miejsce w kolejce. Przydzial, ktorego user nie odebral (claim) w ciagu
+TTL, zwraca expired_grants() - server.py zwalnia wtedy szafke i oddaje
+ja nastepnemu w kolejce.
+"""
+import threading
+import uuid
+from collections import OrderedDict
+from time import monotonic
+
+TTL = 120            # sekundy od ostatniego pytania o bilet
+MAX_WAITERS = 10000
+MAX_WAIT = 30        # najdluzsze trzymanie zapytania (long-poll)
+MAX_HELD = 64        # ile zapytan naraz moze czekac (kazde to watek serwera)
+POLL_INTERVAL = TTL // 2   # sugerowany odstep pytania (Retry-After) - bilet nie wygasa
+
+
+class Waitlist:
+    def __init__(self, ttl=TTL, max_waiters=MAX_WAITERS, max_held=MAX_HELD):
+        self.ttl = ttl
+        self.max_waiters = max_waiters
+        self.max_held = max_held
+        self.held = 0                # zapytania spiace teraz w wait()
+        self.joined = 0              # numer kolejnego wpisu w kolejce
+        self.queue = OrderedDict()   # bilet -> wpis, w kolejnosci przyjscia
+        self.granted = OrderedDict() # bilet -> wpis z przydzielona szafka, do odebrania
+        self.tickets = {}            # bilet -> wpis (oczekujacy i przydzieleni)
+        self.by_user = {}            # user_id -> bilet, jeden bilet na usera
+        self.lock = threading.Lock()
+
+    def join(self, user_id):
+        """
+        Dopisuje usera na koniec kolejki (albo zwraca jego istniejacy bilet).
+        None, jesli kolejka jest pelna.
+        """
+        now = monotonic()
+        with self.lock:
+            entry = self._get(self.by_user.get(user_id), now)
+            if entry is not None:
+                if not entry["claimed"]:
+                    return entry      # czeka albo ma nieodebrany przydzial
+                self._remove(entry)   # poprzedni przydzial juz odebrany
+            if len(self.queue) >= self.max_waiters:
+                self._expire_head(now)
+                if len(self.queue) >= self.max_waiters:
+                    return None
+            entry = {
+                "ticket": uuid.uuid4().hex,
+                "seq": self.joined,
+                "user_id": user_id,
+                "expires": now + self.ttl,
+                "locker_id": None,
+                "claimed": False,
+                "ready": threading.Event(),
+            }
+            self.joined += 1
+            self.queue[entry["ticket"]] = entry
+            self.tickets[entry["ticket"]] = entry
+            self.by_user[user_id] = entry["ticket"]
+            return entry
+
+    def get(self, ticket):
+        """Wpis biletu (przedluza jego waznosc) albo None, jesli wygasl."""
+        now = monotonic()
+        with self.lock:
+            return self._get(ticket, now)
+
+    def leave(self, ticket):
+        with self.lock:
+            entry = self.tickets.get(ticket)
+            if entry is not None:
+                self._remove(entry)
+            return entry
+
+    def waiting(self):
+        """Czy ktos czeka (wygasle bilety na poczatku kolejki sa usuwane)."""
+        with self.lock:
+            self._expire_head(monotonic())
+            return bool(self.queue)
+
+    def grant(self, reserve):
+        """
+        Oddaje szafke pierwszemu waznemu oczekujacemu. reserve(user_id) rezerwuje
+        ja i zwraca locker_id. Wolajacy trzyma lock szafek, wiec nikt inny nie
+        zajmie szafki pomiedzy. Zwraca wpis albo None, gdy nikt nie czeka.
+        """
+        now = monotonic()
+        with self.lock:
+            self._expire_head(now)
+            if not self.queue:
+                return None
+            # Najpierw rezerwacja, potem zdjecie z kolejki - jesli reserve
+            # rzuci (np. blad zapisu do bazy), oczekujacy zostaje pierwszy
+            entry = next(iter(self.queue.values()))
+            locker_id = reserve(entry["user_id"])
+            del self.queue[entry["ticket"]]
+            entry["locker_id"] = locker_id
+            entry["expires"] = now + self.ttl   # czas na odebranie wyniku
+            self.granted[entry["ticket"]] = entry
+        entry["ready"].set()
+        return entry
+
+    def claim(self, entry):
+        """
+        User dowiedzial sie o przydziale - szafka jest juz jego. False, jesli
+        przydzial wygasl i szafka zostala (albo zostanie) zwolniona.
+        """
+        with self.lock:
+            if entry["claimed"]:
+                return True
+            if entry["ticket"] not in self.granted or entry["expires"] <= monotonic():
+                return False
+            entry["claimed"] = True
+            return True
+
+    def expired_grants(self):
+        """
+        Usuwa wygasle przydzialy i zwraca te nieodebrane - ich szafki
+        trzeba zwolnic (wolajacy trzyma lock szafek).
+        """
+        now = monotonic()
+        expired = []
+        with self.lock:
+            # Przydzialy maja ten sam TTL od chwili grant, wiec sa w kolejnosci wygasania
+            while self.granted:
+                entry = next(iter(self.granted.values()))
+                if entry["expires"] > now:
+                    break
+                self._remove(entry)
+                if not entry["claimed"]:
+                    expired.append(entry)
+        return expired
+
+    def position(self, entry):
+        """
+        Miejsce w kolejce liczone od 1 (0 = szafka juz przydzielona), None dla
+        biletu spoza kolejki. Liczone od numeru pierwszego w kolejce, wiec gdy
+        ktos ze srodka zrezygnowal, to gorne oszacowanie.
+        """
+        with self.lock:
+            if entry["locker_id"] is not None:
+                return 0
+            if entry["ticket"] not in self.queue:
+                return None
+            head = next(iter(self.queue.values()))
+            return entry["seq"] - head["seq"] + 1
+
+    def wait(self, entry, timeout):
+        """
+        Spi, az szafka zostanie przydzielona albo minie timeout. Zwraca False
+        bez czekania, gdy czeka juz max_held zapytan - klient pyta ponownie.
+        """
+        with self.lock:
+            if self.held >= self.max_held:
+                return False
+            self.held += 1
+        try:
+            entry["ready"].wait(min(timeout, MAX_WAIT))
+        finally:
+            with self.lock:
+                self.held -= 1
+        return True
+
+    def _get(self, ticket, now):
+        entry = self.tickets.get(ticket)
+        if entry is None:
+            return None
+        if entry["expires"] <= now:
+            # Nieodebrany przydzial zwalnia expired_grants() razem z szafka
+            if entry["locker_id"] is None or entry["claimed"]:
+                self._remove(entry)
+            return None
+        if entry["locker_id"] is None:
+            entry["expires"] = now + self.ttl
+        return entry
+
+    def _remove(self, entry):
+        self.queue.pop(entry["ticket"], None)
+        self.granted.pop(entry["ticket"], None)
+        self.tickets.pop(entry["ticket"], None)
+        if self.by_user.get(entry["user_id"]) == entry["ticket"]:
+            del self.by_user[entry["user_id"]]
+        entry["ready"].set()   # budzi czekajace zapytanie
+
+    def _expire_head(self, now):
+        # Sprzatamy tylko od poczatku kolejki - wygasle bilety dalej w kolejce
+        # zostana usuniete, gdy dojda na poczatek (albo przy get/join).
+        # Przydzialy sprzata expired_grants(), bo trzeba zwolnic szafki.
+        while self.queue:
+            entry = next(iter(self.queue.values()))
+            if entry["expires"] > now:
+                break
+            self._remove(entry)